@@ -1,12 +1,43 @@
+import time
+startTime = time.perf_counter()     # for the startup report
+
+import argparse
+import os
+import sys
+
+parser = argparse.ArgumentParser(prog='hexgrid')
+parser.add_argument('--record', metavar='FILE', help='record all player input to FILE')
+parser.add_argument('--replay', metavar='FILE', help='replay the player input from FILE and verify the final state')
+parser.add_argument('--fast', action='store_true', help='no frame limiter')
+parser.add_argument('--headless', action='store_true', help='no visible window (sdl dummy video driver)')
+parser.add_argument('--capture', metavar='PATH', help='capture the frames as png files into the directory PATH, '
+                    'or as raw rgb24 video if PATH ends in .rgb')
+args = parser.parse_args()
+
+if args.headless:
+    os.environ['SDL_VIDEODRIVER'] = 'dummy'     # before ledwall initializes the display
+
 import pygame
 import pygame._sdl2.controller
-import time
 
 from enum import Enum
 
+import game
+import hexgrid
 import ledwall
+from bot import BotPlayers
+from capture import FrameCapture
+from game import Player
+from gridview import GridView
+from netplay import NetClient, NetHost
+from profiler import FrameProfiler, StartupTimer
+from replay import InputLog, InputRecorder
+from tiles import TiledView
 print = ledwall.print
 
+startup = StartupTimer(startTime)
+startup.mark('imports')
+
 
 # read settings from settings.py
 # use default values if no settings.py exists
@@ -21,21 +52,122 @@ if not 'RENDER_MODE' in dir():
     # 'sim' = led simulation for uli (deprecated)
     # 'arcade' = for toolbox arcade cabinet
     # 'square' = for square displays
+    # 'ddp' = send frames to led controllers over udp, window as preview
+    # 'tiled' = several led walls as one screen (see PANELS), window as preview
     RENDER_MODE = 'led'
 
+if not 'PANELS' in dir():
+    # tiled mode only: (columns, rows) of led walls
+    PANELS = (2, 1)
+
+if not 'PANEL_HOSTS' in dir():
+    # tiled mode only: ddp address of every wall, row by row (None = preview only)
+    PANEL_HOSTS = []
+
+if not 'DDP_HOST' in dir():
+    # led controller address for ddp output (in any render mode)
+    DDP_HOST = '127.0.0.1' if RENDER_MODE == 'ddp' else None
+
+if not 'DDP_PORT' in dir():
+    DDP_PORT = 4048
+
+if not 'DDP_DELTA' in dir():
+    # send only the changed pixel runs, with a full frame every second
+    DDP_DELTA = True
+
 if not 'DEFAULT_BRIGHTNESS' in dir():
     if RENDER_MODE == 'led':
         BRIGHTNESS = -4
     else:
         BRIGHTNESS = 0
 
+if not 'COMPOSE_MODE' in dir():
+    # led mode only:
+    # 'classic' = scale, blit stripe overlay and flip the whole window
+    # 'fast' = copy into every second window column, update changed rects only
+    COMPOSE_MODE = 'classic'
+
+if not 'BRIGHTNESS_MODE' in dir():
+    # 'primitive' = dim every color while drawing
+    # 'frame' = draw at full intensity, dim the whole frame once in compose
+    BRIGHTNESS_MODE = 'primitive'
+
+if not 'VERIFY_TURNS' in dir():
+    # check every player turn against the original turning rules (slow)
+    VERIFY_TURNS = False
+
+if not 'SIM_RATE' in dir():
+    # simulation ticks per second, independent of the render frame rate
+    SIM_RATE = 60
+
+if not 'MAX_SIM_STEPS' in dir():
+    # most simulation ticks run per rendered frame. when rendering falls
+    # further behind, the game slows down instead of stalling
+    MAX_SIM_STEPS = 5
+
+if not 'BOT_PLAYERS' in dir():
+    # players driven by bots until a human presses one of their keys
+    BOT_PLAYERS = [1]
+
+if not 'BOT_TIME_BUDGET' in dir():
+    # seconds a bot may think about one move, in a worker process
+    BOT_TIME_BUDGET = 0.02
+
+if not 'NET_MODE' in dir():
+    # None = local game
+    # 'host' = run the game and send it to clients over udp, take their input
+    # 'client' = show the game of the host at NET_HOST, send local input there
+    NET_MODE = None
+
+if not 'NET_HOST' in dir():
+    # client mode only: address of the host
+    NET_HOST = '127.0.0.1'
+
+if not 'NET_PORT' in dir():
+    NET_PORT = 4049
+
+if not 'PROFILE_LOG' in dir():
+    # write per-stage frame timings to this .jsonl or .csv file
+    PROFILE_LOG = None
+
+if not 'STARTUP_BUDGET' in dir():
+    # seconds from start to the first presented frame, the startup report
+    # says when this was exceeded
+    STARTUP_BUDGET = 2.0
+
 DEADZONE = 0.4
 
 running = True
-output = ledwall.initScreen(RENDER_MODE)
+if RENDER_MODE != 'tiled':
+    PANELS = (1, 1)
 
+startup.mark('settings')
+
+
+# -- startup sequence
+#
+# every step is timed, the report is printed after the first presented
+# frame. everything the first frames would build on the fly (fonts, text
+# masks, console, grid surface) is built in the prewarm step
+
+output = ledwall.initScreen(RENDER_MODE, panels=PANELS)
+
+if DDP_HOST:
+    ledwall.initNetworkOutput(DDP_HOST, DDP_PORT, delta=DDP_DELTA)
+
+capture = None
+if args.capture:
+    capture = FrameCapture(args.capture)
+    ledwall.setFrameCapture(capture)
+
+profiler = FrameProfiler(logFilename=PROFILE_LOG)
+
+ledwall.setComposeMode(COMPOSE_MODE)
+ledwall.setBrightnessMode(BRIGHTNESS_MODE)
 ledwall.setBrightnessValue(BRIGHTNESS)
 
+startup.mark('screen')
+
 
 print('init game controllers...')
 pygame._sdl2.controller.init()
@@ -62,13 +194,15 @@ if not joymode:    # use joystick lib as fallback
             joy.init()
             print(' - ' + joy.get_name())
 
+startup.mark('controllers')
 
-GRID_HEIGHT = 40
-GRID_WIDTH = 11
 
 HEX_WIDTH = 24*1
 HEX_HEIGHT = 24#28#27.7/4.0*1
 
+GRID_HEIGHT = 40 * PANELS[1]
+GRID_WIDTH = ledwall.SCR_W * PANELS[0] // HEX_WIDTH + 1     # 11 on a single wall
+
 PLAYER_COLORS = [(0, 255, 0),
                  (255, 0, 255),
                  (0, 128, 255),
@@ -85,329 +219,160 @@ playerKeys = [(pygame.K_RIGHT, pygame.K_LEFT, pygame.K_DOWN, pygame.K_UP),
               (pygame.K_d, pygame.K_a, pygame.K_s, pygame.K_w),
               ]
 
+keyBindings = {key: (p, d) for p, keys in enumerate(playerKeys) for d, key in enumerate(keys)}
+
 
 clock = pygame.time.Clock()
 tick = 0
 
 def initGrid(width, height):
-    d = {}
-
-    def addSegment(x1, y1, x2, y2, color):
-        index = (x1, y1, x2, y2)
-        d[index] = color
-
-    defaultColor = (64, 64, 64)
-
-    for y in range(height):
-        for x in range(width):
-            addSegment(x, y, x, y+1, defaultColor)
-
-            if y % 4 == 0:
-                addSegment(x, y, x-1, y+1, defaultColor)
-            elif y % 4 == 2:
-                addSegment(x, y, x+1, y+1, defaultColor)
-
-    return d
-
-def setSegmentColor(pointFrom, pointTo, color):
-    points = sorted((pointFrom, pointTo))
-    index = (points[0][0], points[0][1], points[1][0], points[1][1])
-    grid[index] = color
-
-
-def getScreenCoords(x, y):
-    if int(y) % 4 in (0, 3):
-        px = x * HEX_WIDTH
-        py = y * HEX_HEIGHT / 3.
-    else:
-        px = (x + 0.5) * HEX_WIDTH
-        py = y * HEX_HEIGHT / 3.
-
-    return px, py
+    return hexgrid.HexGrid(width, height)
 
 
 grid = initGrid(GRID_WIDTH, GRID_HEIGHT)
+view = GridView(grid, HEX_WIDTH, HEX_HEIGHT)
 
+tiled = None
+if RENDER_MODE == 'tiled':
+    tiled = TiledView(view, ledwall.canvas, PANELS, PANEL_HOSTS, DDP_PORT, delta=DDP_DELTA)
+    ledwall.setTiledOutput(tiled)
 
-class Player:
-    def __init__(self, x, y, color=(255, 255, 255)):
-        self.x = x
-        self.y = y
-
-        self.nextx = x
-        self.nexty = y + 1
+game.VERIFY_TURNS = VERIFY_TURNS
+if VERIFY_TURNS:
+    game.verifyTurnTables()
 
-        self.dist = 0
-        self.nextdir = 1        # for racecar steering only
-        self.speed = 1.0 / 32
 
-        self.idle = True
+spawns = game.spawnPoints(GRID_WIDTH, GRID_HEIGHT)
 
-        self.racecar = False
-        self.input_right_left_down_up = [False, False, False, False]
-        self.target_right_left_down_up = [True, False, False, False]
-
-        self.color = color
-
-
-    def pressLeft(self):
-        self.nextdir = -1
-        self.input_right_left_down_up[1] = True
-        self.idle = False
-
-    def pressRight(self):
-        self.nextdir = 1
-        self.input_right_left_down_up[0] = True
-        self.idle = False
-
-    def pressUp(self):
-        self.input_right_left_down_up[3] = True
-        self.idle = False
-
-    def pressDown(self):
-        self.input_right_left_down_up[2] = True
-        self.idle = False
-
-    def pressDirection(self, d):
-        (self.pressRight,
-         self.pressLeft,
-         self.pressDown,
-         self.pressUp)[d]()
-
-
-    def releaseLeft(self):
-        self.input_right_left_down_up[1] = False
-
-    def releaseRight(self):
-        self.input_right_left_down_up[0] = False
-
-    def releaseUp(self):
-        self.input_right_left_down_up[3] = False
-
-    def releaseDown(self):
-        self.input_right_left_down_up[2] = False
-
-    def releaseDirection(self, d):
-        (self.releaseRight,
-         self.releaseLeft,
-         self.releaseDown,
-         self.releaseUp)[d]()
-
-
-    def turn(self):
-
-        #x=0 : x=1   : x=2
-        #    :       :
-        #    : |     :
-        #    :/ \    :/         y=0
-        # \ /:    \ /:
-        #  | :     | .          y=1
-        #  | :     | .
-        #  | :     |            y=2
-        # / \:    / \
-        #    :\ /               y=3
-        #    : |
-
-        line = self.nexty % 4   # y-line of target (=current) point
-
-        setSegmentColor((self.x, self.y), (self.nextx, self.nexty), self.color)
-
-        downwards = self.nexty - self.y > 0     # whether player came to current point by going down or not
-        rightside = self.nextx == self.x        # whether player was traveling on the right half of the hexagon (including middle - see sketch)
-
-        if not self.racecar:
-
-            neighbours = [(self.nextx, self.nexty-1), (self.nextx, self.nexty+1)]
-            if   line == 0: neighbours.append((self.nextx-1, self.nexty+1))
-            elif line == 1: neighbours.append((self.nextx+1, self.nexty-1))
-            elif line == 2: neighbours.append((self.nextx+1, self.nexty+1))
-            else:           neighbours.append((self.nextx-1, self.nexty-1))
-            neighbours.remove((self.x, self.y))
-
-            nextxScreenCoord, nextyScreenCoord = getScreenCoords(self.nextx, self.nexty)
-            i0_right = getScreenCoords(neighbours[0][0], neighbours[0][1])[0] > nextxScreenCoord
-            i0_left  = getScreenCoords(neighbours[0][0], neighbours[0][1])[0] < nextxScreenCoord
-            i0_down  = getScreenCoords(neighbours[0][0], neighbours[0][1])[1] > nextyScreenCoord
-            i0_up    = getScreenCoords(neighbours[0][0], neighbours[0][1])[1] < nextyScreenCoord
-            i1_right = getScreenCoords(neighbours[1][0], neighbours[1][1])[0] > nextxScreenCoord
-            i1_left  = getScreenCoords(neighbours[1][0], neighbours[1][1])[0] < nextxScreenCoord
-            i1_down  = getScreenCoords(neighbours[1][0], neighbours[1][1])[1] > nextyScreenCoord
-            i1_up    = getScreenCoords(neighbours[1][0], neighbours[1][1])[1] < nextyScreenCoord
-
-            i0_score = 0
-            if self.target_right_left_down_up[0] and i0_right: i0_score += 1
-            if self.target_right_left_down_up[1] and i0_left: i0_score += 1
-            if self.target_right_left_down_up[2] and i0_down: i0_score += 1
-            if self.target_right_left_down_up[3] and i0_up: i0_score += 1
-            if self.target_right_left_down_up[0] and i0_left: i0_score -= 1
-            if self.target_right_left_down_up[1] and i0_right: i0_score -= 1
-            if self.target_right_left_down_up[2] and i0_up: i0_score -= 1
-            if self.target_right_left_down_up[3] and i0_down: i0_score -= 1
-            i1_score = 0
-            if self.target_right_left_down_up[0] and i1_right: i1_score += 1
-            if self.target_right_left_down_up[1] and i1_left: i1_score += 1
-            if self.target_right_left_down_up[2] and i1_down: i1_score += 1
-            if self.target_right_left_down_up[3] and i1_up: i1_score += 1
-            if self.target_right_left_down_up[0] and i1_left: i1_score -= 1
-            if self.target_right_left_down_up[1] and i1_right: i1_score -= 1
-            if self.target_right_left_down_up[2] and i1_up: i1_score -= 1
-            if self.target_right_left_down_up[3] and i1_down: i1_score -= 1
-            neighbour_i = 0 if i0_score > i1_score else 1
-
-            dirx = neighbours[neighbour_i][0] - self.nextx
-            diry = neighbours[neighbour_i][1] - self.nexty
-
-        else: # self.racecar
-
-            if self.nextdir == -1:  # turn left
-                if line == 0:
-                    if downwards:
-                        dirx = 0
-                        diry = 1
-                    else:
-                        if rightside:
-                            dirx = -1
-                            diry = 1
-                        else:
-                            dirx = 0
-                            diry = -1
-
-                elif line == 1:
-                    if downwards:
-                        if rightside:
-                            dirx = 1
-                            diry = -1
-                        else:
-                            dirx = 0
-                            diry = 1
-                    else:
-                        dirx = 0
-                        diry = -1
-
-                elif line == 2:
-                    if downwards:
-                        dirx = 1
-                        diry = 1
-                    else:
-                        if rightside:
-                            dirx = 0
-                            diry = -1
-                        else:
-                            dirx = 0
-                            diry = 1
-
-                elif line == 3:
-                    if downwards:
-                        if rightside:
-                            dirx = 0
-                            diry = 1
-                        else:
-                            dirx = 0
-                            diry = -1
-                    else:
-                        dirx = -1
-                        diry = -1
-
-            elif self.nextdir == 1: # turn right
-                if line == 0:
-                    if downwards:
-                        dirx = -1
-                        diry = 1
-                    else:
-                        if rightside:
-                            dirx = 0
-                            diry = -1
-                        else:
-                            dirx = 0
-                            diry = 1
-
-                elif line == 1:
-                    if downwards:
-                        if rightside:
-                            dirx = 0
-                            diry = 1
-                        else:
-                            dirx = 0
-                            diry = -1
-                    else:
-                        dirx = 1
-                        diry = -1
-
-                elif line == 2:
-                    if downwards:
-                        dirx = 0
-                        diry = 1
-                    else:
-                        if rightside:
-                            dirx = 1
-                            diry = 1
-                        else:
-                            dirx = 0
-                            diry = -1
-
-                elif line == 3:
-                    if downwards:
-                        if rightside:
-                            dirx = -1
-                            diry = -1
-                        else:
-                            dirx = 0
-                            diry = 1
-                    else:
-                        dirx = 0
-                        diry = -1
-
-        self.x = self.nextx
-        self.y = self.nexty
-
-        self.nextx += dirx
-        self.nexty += diry
-
-        self.dist = 0
-
-player1 = Player(4, 12, color=PLAYER_COLORS[0])
-player2 = Player(GRID_WIDTH - 4, GRID_HEIGHT - 12, color=PLAYER_COLORS[1])
+player1 = Player(*spawns[0], color=PLAYER_COLORS[0], grid=grid, number=0)
+player2 = Player(*spawns[1], color=PLAYER_COLORS[1], grid=grid, number=1)
 
 players = [player1, player2]
 
+startup.mark('game')
+
+
+# -- player input
+#
+# all player input goes through pressDirection() / releaseDirection(), so it
+# can be recorded. while replaying, live input is ignored and the recorded
+# input is fed back at the same simulation ticks. pollTime is when the
+# events being handled were taken from the queue, for latency measurement.
+# a human pressing a key of a bot player takes it over from the bot. input
+# of network clients comes in like local input, a client itself sends its
+# input to the host instead
+
+# the host of a network game simulates, and records
+recorder = InputRecorder(args.record) if args.record and NET_MODE != 'client' else None
+replayLog = InputLog(args.replay) if args.replay and NET_MODE != 'client' else None
+pollTime = 0.
+
+netHost = None
+netClient = None
+if NET_MODE == 'host':
+    netHost = NetHost(grid, players, NET_PORT)
+elif NET_MODE == 'client':
+    netClient = NetClient(grid, players, NET_HOST, NET_PORT)
+
+bots = None
+if BOT_PLAYERS and replayLog is None and netClient is None:
+    bots = BotPlayers([p for p in BOT_PLAYERS if p < len(players)], BOT_TIME_BUDGET)
+
+def pressDirection(p, d, human=True):
+    if netClient is not None:
+        netClient.pressDirection(p, d)
+        profiler.markInput(pollTime)
+        return
+    if replayLog is None and p < len(players):
+        if human and bots is not None and bots.takeOver(p):
+            print('player %d taken over from bot' % (p + 1))
+        if recorder:
+            recorder.record(tick, p, d, True)
+        players[p].pressDirection(d)
+        if human:
+            profiler.markInput(pollTime)
+
+def releaseDirection(p, d, human=True):
+    if netClient is not None:
+        netClient.releaseDirection(p, d)
+        profiler.markInput(pollTime)
+        return
+    if replayLog is None and p < len(players):
+        if human and bots is not None and p in bots.numbers:
+            return
+        if recorder:
+            recorder.record(tick, p, d, False)
+        players[p].releaseDirection(d)
+        if human:
+            profiler.markInput(pollTime)
+
+startup.mark('bots')
+
+def replayInput():
+    for p, d, pressed in replayLog.eventsAt(tick):
+        if pressed:
+            players[p].pressDirection(d)
+        else:
+            players[p].releaseDirection(d)
+
+
+# -- simulation
+#
+# one call is one simulation tick, recorded input is keyed on these ticks,
+# so replays do not depend on the frame rate. when a round is over, the
+# trails stay on screen for ROUND_END_TICKS before the next round starts
+
+SIM_DT = 1.0 / SIM_RATE
+ROUND_END_TICKS = 120
+
+roundEndTick = None
+
+def newRound():
+    global roundEndTick
+
+    grid.reset()
+    for player, spawn in zip(players, spawns):
+        player.reset(*spawn)
+
+    roundEndTick = None
+
+def simulate():
+    global tick, roundEndTick
+
+    if replayLog is not None:
+        replayInput()
+
+    game.updatePlayers(players)
+    tick += 1
 
-while running:
-    output.fill((0, 0, 0))
-
-    # draw grid
-
-    for segment, color in grid.items():
-        x1, y1, x2, y2 = segment
-
-        x1, y1 = getScreenCoords(x1, y1)
-        x2, y2 = getScreenCoords(x2, y2)
-
-        pygame.draw.line(output, ledwall.brightness(color), (x1, y1), (x2, y2))
-
-
-
-    # draw players
+    if roundEndTick is None:
+        if game.roundOver(players):
+            roundEndTick = tick + ROUND_END_TICKS
+    elif tick >= roundEndTick:
+        newRound()
 
-    for player in players:
-        oldx, oldy = getScreenCoords(player.x, player.y)
-        newx, newy = getScreenCoords(player.nextx, player.nexty)
+    if netHost is not None:
+        netHost.sendTick(tick)
 
-        x = oldx + (newx - oldx) * player.dist
-        y = oldy + (newy - oldy) * player.dist
 
-        pygame.draw.ellipse(output, ledwall.brightness(player.color), rect=(x-2, y-2, 5, 5))
+LOGO_TEXT = 'HEXGRID'
+LOGO_FONTSIZE = 3
 
-    # draw logo
+ledwall.prewarm([(LOGO_TEXT, LOGO_FONTSIZE)])
+view.updateSurface(ledwall.canvas if tiled is not None else output)
+startup.mark('prewarm')
 
-    if tick % 32 < 24 and tick < 60 * 2:
-        ledwall.centerText('HEXGRID', y=2, color=(0, 255, 0), fontsize=3)
 
-    ledwall.compose(do_cls=False)
+accumulator = 0.
+lastTime = time.perf_counter()
 
+while running:
+    profiler.beginFrame()
 
     # event handling
 
     events = pygame.event.get()
+    pollTime = time.perf_counter()
 
     for e in events:
         if e.type==pygame.QUIT:
@@ -424,22 +389,19 @@ while running:
                 BRIGHTNESS = min(BRIGHTNESS + 1, 0)
                 ledwall.setBrightnessValue(BRIGHTNESS)
                 #EventTimer.set('brightness-msg', 60)
+            elif e.key == pygame.K_F3:
+                profiler.toggleOverlay()
             elif e.key == pygame.K_F5:
                 ledwall.enableOverlay(not ledwall.showOverlay)
             elif e.key == pygame.K_F11:
                 pygame.display.toggle_fullscreen()
 
-            else:
-                for p, keys in enumerate(playerKeys):
-                    for d, key in enumerate(keys):
-                        if e.key == key:
-                            players[p].pressDirection(d)
+            elif e.key in keyBindings:
+                pressDirection(*keyBindings[e.key])
 
         elif e.type == pygame.KEYUP:
-                for p, keys in enumerate(playerKeys):
-                    for d, key in enumerate(keys):
-                        if e.key == key:
-                            players[p].releaseDirection(d)
+            if e.key in keyBindings:
+                releaseDirection(*keyBindings[e.key])
 
         elif e.type == pygame.CONTROLLERAXISMOTION and joymode == 'controller':
             value = max(-1, e.value / 32767)
@@ -448,25 +410,25 @@ while running:
             if e.axis == pygame.CONTROLLER_AXIS_LEFTX:
                 if value < 0:
                     if value < -DEADZONE:
-                        players[p].pressLeft()
+                        pressDirection(p, game.LEFT)
                     else:
-                        players[p].releaseLeft()
+                        releaseDirection(p, game.LEFT)
                 else:
                     if value > DEADZONE:
-                        players[p].pressRight()
+                        pressDirection(p, game.RIGHT)
                     else:
-                        players[p].releaseRight()
+                        releaseDirection(p, game.RIGHT)
             elif e.axis == pygame.CONTROLLER_AXIS_LEFTY:
                 if value < 0:
                     if value < -DEADZONE:
-                        players[p].pressUp()
+                        pressDirection(p, game.UP)
                     else:
-                        players[p].releaseUp()
+                        releaseDirection(p, game.UP)
                 else:
                     if value > DEADZONE:
-                        players[p].pressDown()
+                        pressDirection(p, game.DOWN)
                     else:
-                        players[p].releaseDown()
+                        releaseDirection(p, game.DOWN)
 
         elif e.type == pygame.CONTROLLERBUTTONDOWN and joymode == 'controller':
             p = e.instance_id
@@ -475,41 +437,167 @@ while running:
                 pass
 
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_LEFT:
-                players[p].pressLeft()
+                pressDirection(p, game.LEFT)
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_RIGHT:
-                players[p].pressRight()
+                pressDirection(p, game.RIGHT)
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_UP:
-                players[p].pressUp()
+                pressDirection(p, game.UP)
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_DOWN:
-                players[p].pressDown()
+                pressDirection(p, game.DOWN)
 
         elif e.type == pygame.CONTROLLERBUTTONUP and joymode == 'controller':
             p = e.instance_id
 
             if e.button == pygame.CONTROLLER_BUTTON_DPAD_LEFT:
-                players[p].releaseLeft()
+                releaseDirection(p, game.LEFT)
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_RIGHT:
-                players[p].releaseRight()
+                releaseDirection(p, game.RIGHT)
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_UP:
-                players[p].releaseUp()
+                releaseDirection(p, game.UP)
             elif e.button == pygame.CONTROLLER_BUTTON_DPAD_DOWN:
-                players[p].releaseDown()
+                releaseDirection(p, game.DOWN)
 
-    # update players
+    if netHost is not None:
+        for p, d, pressed in netHost.update():
+            if pressed:
+                pressDirection(p, d)
+            else:
+                releaseDirection(p, d)
+
+    if bots is not None:
+        for p, d, pressed in bots.update(grid, players):
+            if pressed:
+                pressDirection(p, d, human=False)
+            else:
+                releaseDirection(p, d, human=False)
+
+    profiler.mark('events')
+
+    # fixed timestep simulation: run as many ticks as the elapsed time asks
+    # for, rendering interpolates between the last two simulation states
+
+    now = time.perf_counter()
+    accumulator += now - lastTime
+    lastTime = now
+
+    if netClient is not None:     # the host simulates, ticks come with its state
+        steps = 0
+        accumulator = 0.
+        if netClient.update():
+            tick = netClient.tick
+            profiler.markSimulated()
+        if netClient.error is not None:
+            print('net: %s, ignoring its state' % netClient.error)
+            netClient.error = None
+    elif args.fast:
+        steps = 1
+        accumulator = 0.
+    else:
+        steps = min(int(accumulator / SIM_DT), MAX_SIM_STEPS)
+        accumulator -= steps * SIM_DT
+        if accumulator >= SIM_DT:   # too far behind, drop the time
+            accumulator %= SIM_DT
 
-    for player in players:
-        if True in player.input_right_left_down_up: player.target_right_left_down_up = list(player.input_right_left_down_up)
+    for i in range(steps):
+        simulate()
 
-        if not player.idle:
-            player.dist += player.speed
-            if player.dist >= 1.0:
-                player.turn()
+        if replayLog is not None and tick >= replayLog.endTick:
+            running = False
+            break
 
-    clock.tick(60)
-    tick += 1
+    if steps:
+        profiler.markSimulated()
+    profiler.mark('update')
+
+    alpha = accumulator / SIM_DT
+
+    # draw grid (also clears the rest of the previous frame)
+
+    if tiled is not None:   # grid and players, only where something changed
+        tiled.draw(players, alpha)
+        profiler.mark('grid')
+    else:
+        view.drawGrid(output)
+        profiler.mark('grid')
+
+
+        # draw players
+
+        view.drawPlayers(output, players, alpha)
+    profiler.mark('players')
+
+    # draw logo
+
+    if tick % 32 < 24 and tick < 60 * 2:
+        ledwall.centerText(LOGO_TEXT, y=2, color=(0, 255, 0), fontsize=LOGO_FONTSIZE)
+
+    profiler.drawOverlay()
+    profiler.mark('text')
+
+    ledwall.compose(do_cls=False, profiler=profiler)
+    profiler.markPresented()
+    profiler.mark('compose')
+
+    if startup is not None:
+        startup.mark('first frame')
+        sys.stdout.write('\n'.join(startup.report(STARTUP_BUDGET)) + '\n')
+        startup = None
 
     if tick >= 60 * 4:
         ledwall.cls()
 
+    if not args.fast:
+        clock.tick(60)
+    profiler.mark('wait')
+    profiler.endFrame()
+
     #print('tick =', tick)
 
+profiler.stopLog()
+ledwall.closeNetworkOutput()
+
+if capture is not None:
+    ledwall.setFrameCapture(None)
+    capture.close()
+    print('captured %(written)d of %(frames)d frames, %(dropped)d dropped' % capture.stats())
+    if capture.raw:
+        size = (ledwall.canvas or ledwall.output).get_size()
+        print('to encode: ffmpeg -f rawvideo -pix_fmt rgb24 -s %dx%d -r 60 -i %s capture.mp4' % (size[0], size[1], args.capture))
+if tiled is not None:
+    tiled.close()
+
+if netHost is not None:
+    netHost.close()
+    print('net: %d packets, %d bytes sent in %d ticks, %d keyframes, %d bad packets dropped'
+          % (netHost.packetsSent, netHost.bytesSent, tick, netHost.keyframesSent, netHost.packetsRejected))
+
+if netClient is not None:
+    netClient.close()
+    print('net: %d deltas and %d keyframes applied, %d gaps, %d bad packets dropped'
+          % (netClient.deltasApplied, netClient.keyframesApplied, netClient.gaps, netClient.packetsRejected))
+
+if bots is not None:
+    bots.close()
+    if bots.failed:
+        print('bots: worker process died, bots were stopped')
+    if bots.decisions:
+        print('bots: %(decisions)d decisions (%(late)d late), %(decision_mean_ms).2f ms mean, %(decision_max_ms).2f ms max' % bots.stats())
+
+latency = profiler.latencyStats()
+if latency:
+    print('input latency: %(mean_ms).2f ms mean, %(p95_ms).2f ms p95, %(max_ms).2f ms max (%(samples)d inputs)' % latency)
+
+if recorder:
+    recorder.close(tick, game.stateHash(grid, players))
+    print('recorded %d input events in %d ticks to %s' % (recorder.events, tick, args.record))
+
+if replayLog is not None:
+    if tick < replayLog.endTick:
+        print('replay stopped at tick %d of %d' % (tick, replayLog.endTick))
+        sys.exit(1)
+    elif replayLog.stateHash and game.stateHash(grid, players) != replayLog.stateHash:
+        print('replay diverged: final state hash differs from the recording')
+        sys.exit(1)
+    else:
+        print('replay ok: %d input events, %d ticks' % (replayLog.events, tick))
+
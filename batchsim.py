@@ -0,0 +1,290 @@
+import argparse
+import time
+
+import numpy as np
+
+import game
+import hexgrid
+
+
+# -- headless batch simulation
+#
+# advances many independent games at once. every per-player field of
+# game.Player is a (numGames, numPlayers) array, segment colors are stored
+# per game as palette indices (0 = grid color, 1 + i = color of player i).
+# step() follows the same rules as the main loop plus Player.turn, using the
+# same turn tables and the same collision rules (see HexGrid.isBlocked()).
+# segmentColors doubles as the segment occupancy, node owners are kept in
+# a (numGames, numNodes) array
+
+TARGET_TURNS = np.array([turn or (0, 0) for turn in game.TARGET_TURNS], dtype=np.int32)
+RACECAR_TURNS = np.array([turn or (0, 0) for turn in game.RACECAR_TURNS], dtype=np.int32)
+
+RIGHT, LEFT, DOWN, UP = game.RIGHT, game.LEFT, game.DOWN, game.UP
+
+
+class BatchSim:
+    def __init__(self, numGames, numPlayers=2, width=11, height=40, spawns=None, speed=1.0 / 32, palette=None):
+        self.numGames = numGames
+        self.numPlayers = numPlayers
+
+        self.grid = hexgrid.HexGrid(width, height)
+
+        if palette is None:
+            palette = [self.grid.defaultColor] + [(255, 255, 255)] * numPlayers
+        self.palette = np.array(palette, dtype=np.uint8)
+
+        if spawns is None:
+            spawns = game.spawnPoints(width, height)[:numPlayers]
+        self.spawns = np.array(spawns, dtype=np.int32)
+
+        shape = (numGames, numPlayers)
+
+        self.x = np.empty(shape, dtype=np.int32)
+        self.y = np.empty(shape, dtype=np.int32)
+        self.nextx = np.empty(shape, dtype=np.int32)
+        self.nexty = np.empty(shape, dtype=np.int32)
+
+        self.dist = np.empty(shape, dtype=np.float64)
+        self.speed = np.full(shape, speed, dtype=np.float64)
+        self.nextdir = np.empty(shape, dtype=np.int8)
+
+        self.idle = np.empty(shape, dtype=bool)
+        self.crashed = np.empty(shape, dtype=bool)
+        self.racecar = np.zeros(shape, dtype=bool)
+
+        # bit masks of right = 1, left = 2, down = 4, up = 8
+        self.inputMask = np.zeros(shape, dtype=np.uint8)
+        self.targetMask = np.empty(shape, dtype=np.uint8)
+
+        self.segmentColors = np.empty((numGames, self.grid.numSegments), dtype=np.uint8)
+        self.nodeOwner = np.empty((numGames, self.grid.numNodes), dtype=np.int8)
+
+        self.ticks = 0
+        self.reset()
+
+    def reset(self, games=None):
+        # all games, or only the given ones (e.g. those where roundOver() is
+        # set). held input is kept, like Player.reset()
+        if games is None:
+            games = slice(None)
+            self.ticks = 0
+
+        self.x[games] = self.spawns[:, 0]
+        self.y[games] = self.spawns[:, 1]
+        self.nextx[games] = self.x[games]
+        self.nexty[games] = self.y[games] + 1
+
+        self.dist[games] = 0
+        self.nextdir[games] = 1
+        self.idle[games] = True
+        self.crashed[games] = False
+
+        self.targetMask[games] = 1 << RIGHT
+
+        self.segmentColors[games] = 0
+        self.nodeOwner[games] = hexgrid.NO_OWNER
+
+    def roundOver(self):
+        # per game, same rule as game.roundOver()
+        alive = self.numPlayers - self.crashed.sum(axis=1)
+        return (alive < self.numPlayers) & (alive <= 1)
+
+    # -- input, same semantics as Player.pressDirection() / releaseDirection()
+
+    def press(self, games, players, direction):
+        self.inputMask[games, players] |= 1 << direction
+        self.idle[games, players] = False
+
+        if direction == RIGHT:
+            self.nextdir[games, players] = 1
+        elif direction == LEFT:
+            self.nextdir[games, players] = -1
+
+    def release(self, games, players, direction):
+        self.inputMask[games, players] &= ~np.uint8(1 << direction)
+
+    def setInput(self, inputMask):
+        # replaces the held directions of all players at once, as if the
+        # differences had been pressed and released
+        inputMask = np.asarray(inputMask, dtype=np.uint8)
+        pressed = inputMask & ~self.inputMask
+
+        self.idle &= pressed == 0
+        self.nextdir[(pressed & (1 << RIGHT)) != 0] = 1
+        self.nextdir[(pressed & (1 << LEFT)) != 0] = -1
+
+        self.inputMask[:] = inputMask
+
+    # -- simulation
+
+    def step(self):
+        held = self.inputMask != 0
+        self.targetMask[held] = self.inputMask[held]
+
+        self.dist += np.where(self.idle | self.crashed, 0., self.speed)
+
+        games, players = np.nonzero(self.dist >= 1.0)
+        if len(games):
+            self._turn(games, players)
+
+        self.ticks += 1
+
+    def run(self, steps):
+        for i in range(steps):
+            self.step()
+
+    def _turn(self, games, players):
+        # players turn in index order like in game.updatePlayers(), so a node
+        # taken by one player is seen by the following ones in the same tick
+        for p in range(self.numPlayers):
+            g = games[players == p]
+            if len(g):
+                self._turnPlayer(g, p)
+
+    def _blocked(self, games, x, y, nextx, nexty):
+        # HexGrid.isBlocked() for many games, also returns the segment index
+        grid = self.grid
+
+        onGrid = (x >= -1) & (x <= grid.width) & (y >= 0) & (y <= grid.height)
+        node = np.where(onGrid, y * grid.nodeStride + x + 1, 0)
+        segment = np.where(onGrid, grid.nodeSegments[node, (nextx - x + 1) * 3 + (nexty - y + 1)], -1)
+
+        target = np.where(segment >= 0, nexty * grid.nodeStride + nextx + 1, 0)
+        blocked = (segment < 0) | (self.nodeOwner[games, target] != hexgrid.NO_OWNER)
+
+        return blocked, segment
+
+    def _turnPlayer(self, games, p):
+        x = self.x[games, p]
+        y = self.y[games, p]
+        nextx = self.nextx[games, p]
+        nexty = self.nexty[games, p]
+
+        # crash if the node ahead was taken while traveling, otherwise claim
+        # the segment just traveled
+
+        blocked, segment = self._blocked(games, x, y, nextx, nexty)
+        if blocked.any():
+            self.crashed[games[blocked], p] = True
+
+            arrived = ~blocked
+            games, x, y, nextx, nexty, segment = (a[arrived] for a in (games, x, y, nextx, nexty, segment))
+
+        nodes = self.grid.segmentNodes[segment]
+        self.segmentColors[games, segment] = p + 1
+        self.nodeOwner[games, nodes[:, 0]] = p
+        self.nodeOwner[games, nodes[:, 1]] = p
+
+        # look up the next step
+
+        state = (nexty % 4) * 9 + (nextx - x + 1) * 3 + (nexty - y + 1)
+
+        if self.racecar[0, p] and self.racecar[:, p].all():
+            step = RACECAR_TURNS[state << 1 | (self.nextdir[games, p] == 1)]
+        else:
+            targetStep = TARGET_TURNS[state << 4 | self.targetMask[games, p]]
+            racecarStep = RACECAR_TURNS[state << 1 | (self.nextdir[games, p] == 1)]
+            step = np.where(self.racecar[games, p][:, None], racecarStep, targetStep)
+
+        newx = nextx + step[:, 0]
+        newy = nexty + step[:, 1]
+
+        self.x[games, p] = nextx
+        self.y[games, p] = nexty
+        self.nextx[games, p] = newx
+        self.nexty[games, p] = newy
+
+        self.dist[games, p] = 0
+
+        blocked, segment = self._blocked(games, nextx, nexty, newx, newy)
+        self.crashed[games[blocked], p] = True
+
+    # -- results
+
+    def colors(self, g):
+        # (numSegments, 3) colors of one game, same layout as HexGrid.colors
+        return self.palette[self.segmentColors[g]]
+
+
+# -- checking against game.Player and benchmarking
+
+def verify(steps=20000, numPlayers=2, seed=1):
+    rng = np.random.default_rng(seed)
+
+    # distinct player colors, the last player uses racecar steering
+    palette = [hexgrid.DEFAULT_COLOR] + [(i, i, i) for i in range(1, numPlayers + 1)]
+    sim = BatchSim(1, numPlayers, palette=palette)
+    sim.racecar[0, -1] = True
+
+    grid = hexgrid.HexGrid(sim.grid.width, sim.grid.height)
+    players = [game.Player(x, y, color=palette[1 + i], grid=grid, number=i) for i, (x, y) in enumerate(sim.spawns.tolist())]
+    players[-1].racecar = True
+
+    rounds = 0
+
+    for tick in range(steps):
+        for p, player in enumerate(players):
+            if rng.random() < 0.05:
+                d = int(rng.integers(4))
+                if player.input_right_left_down_up[d]:
+                    player.releaseDirection(d)
+                    sim.release(0, p, d)
+                else:
+                    player.pressDirection(d)
+                    sim.press(0, p, d)
+
+        game.updatePlayers(players)
+        sim.step()
+
+        for p, player in enumerate(players):
+            state = (player.x, player.y, player.nextx, player.nexty, player.dist, player.crashed)
+            simState = (sim.x[0, p], sim.y[0, p], sim.nextx[0, p], sim.nexty[0, p], sim.dist[0, p], sim.crashed[0, p])
+            assert state == simState, 'tick %d player %d: %s != %s' % (tick, p, state, simState)
+
+        if game.roundOver(players):
+            assert sim.roundOver()[0], 'tick %d: round not over' % tick
+            assert (grid.colors == sim.colors(0)).all(), 'tick %d: segment colors differ' % tick
+            assert (grid.nodeOwner == sim.nodeOwner[0]).all(), 'tick %d: node owners differ' % tick
+
+            grid.reset()
+            for player, (x, y) in zip(players, sim.spawns.tolist()):
+                player.reset(x, y)
+            sim.reset()
+            rounds += 1
+
+    assert (grid.colors == sim.colors(0)).all(), 'segment colors differ'
+    return rounds
+
+def benchmark(numGames, numPlayers, steps, seed=1):
+    rng = np.random.default_rng(seed)
+    sim = BatchSim(numGames, numPlayers)
+
+    inputs = rng.integers(1, 16, size=(16, numGames, numPlayers), dtype=np.uint8)
+
+    start = time.perf_counter()
+    for i in range(steps):
+        if i % 16 == 0:
+            sim.reset(np.flatnonzero(sim.roundOver()))
+            sim.setInput(inputs[(i // 16) % len(inputs)])
+        sim.step()
+    elapsed = time.perf_counter() - start
+
+    playerTicks = numGames * numPlayers * steps
+    print('%d games x %d players x %d steps in %.3fs: %.1fM player-ticks/s'
+          % (numGames, numPlayers, steps, elapsed, playerTicks / elapsed / 1e6))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='headless batch simulation of hexgrid games')
+    parser.add_argument('--games', type=int, default=4096)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=1000)
+    parser.add_argument('--verify', action='store_true', help='compare against game.Player instead of benchmarking')
+    args = parser.parse_args()
+
+    if args.verify:
+        rounds = verify(numPlayers=args.players)
+        print('batch simulation matches game.Player (%d rounds)' % rounds)
+    else:
+        benchmark(args.games, args.players, args.steps)
@@ -0,0 +1,212 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+# headless and without frame limiter, must be set before pygame is initialized
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+
+import numpy as np
+
+import game
+import hexgrid
+import ledwall
+from game import Player
+from gridview import GridView
+
+
+# -- render loop benchmark
+#
+# runs the stages of the main loop for a fixed number of frames and reports
+# per-stage timings as json. sizes are (grid width, grid height), the hex
+# size is scaled so that every grid fills the led wall.
+#
+# net_blocks_per_frame is the change in live memory blocks, temporaries
+# freed within the stage do not show. peak_alloc_kb_per_frame comes from
+# ALLOC_FRAMES extra frames run under tracemalloc after the timed ones: the
+# most memory a stage had allocated at once above what it started with,
+# which is where per-frame churn shows
+#
+#   python3 bench.py --save-baseline bench_baseline.json
+#   python3 bench.py --baseline bench_baseline.json
+
+STAGES = ['update', 'grid', 'players', 'text', 'printlog', 'compose']
+
+DEFAULT_SIZES = ['11x40', '22x80', '44x160', '88x320']
+
+ALLOC_FRAMES = 30
+
+PLAYER_COLORS = [(0, 255, 0),
+                 (255, 0, 255),
+                 (0, 128, 255),
+                 (255, 255, 0)
+                 ]
+
+
+def parseSize(size):
+    width, height = size.split('x')
+    return int(width), int(height)
+
+def runBenchmark(output, width, height, frames, rebuild=False, seed=1):
+    rng = np.random.default_rng(seed)
+
+    # a full screen of console lines, without echoing them to stdout
+    ledwall.cls()
+    for i in range(ledwall.SCR_H // ledwall.getFont(1).char_h):
+        ledwall.writeConsole('benchmark line %d' % i)
+
+    scale = 11 / width
+    grid = hexgrid.HexGrid(width, height)
+    view = GridView(grid, 24 * scale, 24 * 40 / height)
+
+    spawns = game.spawnPoints(width, height)
+    players = [Player(x, y, color=PLAYER_COLORS[i], grid=grid, number=i) for i, (x, y) in enumerate(spawns)]
+    for player in players:
+        player.speed = 1.0 / 4
+
+    timings = {stage: [] for stage in STAGES}
+    blocks = {stage: 0 for stage in STAGES}
+    peaks = {stage: 0 for stage in STAGES}
+
+    def run(stage, function, *args, **kwargs):
+        if tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            function(*args, **kwargs)
+            peaks[stage] += tracemalloc.get_traced_memory()[1] - current
+            return
+
+        allocated = sys.getallocatedblocks()
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        end = time.perf_counter()
+        blocks[stage] += sys.getallocatedblocks() - allocated
+        timings[stage].append(end - start)
+
+    def steer():
+        if game.roundOver(players):
+            grid.reset()
+            for player, (x, y) in zip(players, spawns):
+                player.reset(x, y)
+
+        for player in players:
+            if rng.random() < 0.1:
+                d = int(rng.integers(4))
+                if player.input_right_left_down_up[d]:
+                    player.releaseDirection(d)
+                else:
+                    player.pressDirection(d)
+
+    def runFrame():
+        steer()
+
+        if rebuild:
+            view.invalidate()
+
+        run('update', game.updatePlayers, players)
+        run('grid', view.drawGrid, output)
+        run('players', view.drawPlayers, output, players)
+        run('text', ledwall.centerText, 'HEXGRID', y=2, color=(0, 255, 0), fontsize=3)
+        run('printlog', ledwall._drawPrintLog)
+        run('compose', ledwall._present)
+
+    view.drawGrid(output)   # initial full draw is not part of the timings
+
+    start = time.perf_counter()
+    for frame in range(frames):
+        runFrame()
+    elapsed = time.perf_counter() - start
+
+    allocFrames = min(frames, ALLOC_FRAMES)
+    tracemalloc.start()
+    for frame in range(allocFrames):
+        runFrame()
+    tracemalloc.stop()
+
+    result = {'mode': ledwall.renderMode,
+              'size': '%dx%d' % (width, height),
+              'segments': grid.numSegments,
+              'frames': frames,
+              'fps': frames / elapsed,
+              'stages': {},
+              }
+
+    for stage in STAGES:
+        t = sorted(timings[stage])
+        result['stages'][stage] = {'mean_ms': statistics.fmean(t) * 1000,
+                                   'p50_ms': t[len(t) // 2] * 1000,
+                                   'p99_ms': t[min(len(t) - 1, int(len(t) * 0.99))] * 1000,
+                                   'net_blocks_per_frame': blocks[stage] / frames,
+                                   'peak_alloc_kb_per_frame': peaks[stage] / allocFrames / 1024,
+                                   }
+
+    return result
+
+def findRegressions(results, baseline, threshold):
+    base = {(r['mode'], r['size']): r for r in baseline['results']}
+    regressions = []
+
+    for r in results:
+        b = base.get((r['mode'], r['size']))
+        if b is None:
+            continue
+
+        for stage, stats in r['stages'].items():
+            if stage not in b['stages']:
+                continue
+            old = b['stages'][stage]['mean_ms']
+            new = stats['mean_ms']
+            if new > old * (1 + threshold) and new - old > 0.01:
+                regressions.append({'mode': r['mode'], 'size': r['size'], 'stage': stage,
+                                    'baseline_ms': old, 'mean_ms': new})
+
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='hexgrid render loop benchmark')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--modes', nargs='+', default=['plain', 'led'])
+    parser.add_argument('--sizes', nargs='+', default=DEFAULT_SIZES, help='grid sizes as WIDTHxHEIGHT')
+    parser.add_argument('--rebuild', action='store_true', help='force a full grid redraw every frame')
+    parser.add_argument('--brightness-mode', choices=['primitive', 'frame'], default='primitive')
+    parser.add_argument('--compose-mode', choices=['classic', 'fast'], default='classic')
+    parser.add_argument('--baseline', help='compare against this baseline json')
+    parser.add_argument('--save-baseline', help='write the results to this file as new baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown per stage (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    ledwall.setBrightnessMode(args.brightness_mode)
+    ledwall.setComposeMode(args.compose_mode)
+
+    results = []
+    for mode in args.modes:
+        # the screen is set up once per mode, sdl's dummy driver can not
+        # recreate a scaled window
+        output = ledwall.initScreen(mode)
+
+        for size in args.sizes:
+            results.append(runBenchmark(output, *parseSize(size), args.frames, rebuild=args.rebuild))
+
+    report = {'frames': args.frames, 'rebuild': args.rebuild, 'brightness_mode': args.brightness_mode,
+              'compose_mode': args.compose_mode, 'results': results}
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['threshold'] = args.threshold
+        report['regressions'] = findRegressions(results, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    if report.get('regressions'):
+        sys.exit(1)
@@ -3,19 +3,166 @@
 ### BitmapFont
 ### by zeha@drwuro.com
 ###
-### version 1.3 (2025)
+### version 1.4 (2026)
 ###
 #########################
 
 
+import sys
+from collections import OrderedDict
+
 import pygame
 
+import fontfile
+
 NUM_CHARS = 96
 TEXT_CACHING = True
 
+TEXT_CACHE_BYTES = 1 << 20      # rendered strings
+
+GLYPH_INDEX = 1     # palette entry of the glyph pixels, 0 is the transparent background
+ATLAS_PALETTE = [(0, 0, 0)] + [(255, 255, 255)] * 255
+
+COMPILED_ZOOMS = (1, 2, 3)
+
+
+# -- shared glyph atlases
+#
+# every font file is decoded once into an 8 bit mask, zoomed versions are
+# scaled once from that. colors are applied by setting the glyph palette
+# entry right before blitting, so a new color costs neither memory nor a
+# rescale of the font. with a current compiled font next to the image (see
+# fontfile.py) the masks are mapped from that instead, nothing is decoded
+
+_atlases = {}
+_compiled = {}      # image filename -> fontfile.FontFile or None
+
+def loadAtlas(filename, width=None, height=None):
+    key = (filename, width, height)
+    atlas = _atlases.get(key)
+
+    if atlas is None:
+        if filename not in _compiled:
+            _compiled[filename] = fontfile.openCompiled(filename)
+        compiled = _compiled[filename]
+
+        plane = None
+        if compiled is not None:
+            plane = compiled.plane(1) if width is None else compiled.planeBySize(width, height)
+
+        if plane is not None:
+            w, h, mask = plane
+            try:
+                atlas = pygame.image.frombuffer(mask, (w, h), 'P')
+                atlas.set_palette(ATLAS_PALETTE)
+            except ValueError:      # a damaged compiled font, use the image
+                atlas = None
+
+        if atlas is None and width is None:
+            atlas = decodeAtlas(filename)
+        elif atlas is None:
+            atlas = loadAtlas(filename)
+            if atlas.get_size() != (width, height):
+                atlas = pygame.transform.scale(atlas, (width, height))
+
+        atlas.set_colorkey(0)
+        _atlases[key] = atlas
+
+    return atlas
+
+def decodeAtlas(filename):
+    image = pygame.image.load(filename)
+
+    # flatten onto black first, 8 bit targets ignore per pixel alpha
+    flat = pygame.Surface(image.get_size(), 0, 32)
+    flat.blit(image, (0, 0))
+
+    atlas = pygame.Surface(image.get_size(), 0, 8)
+    atlas.set_palette(ATLAS_PALETTE)
+    atlas.blit(flat, (0, 0))
+
+    return atlas
+
+def compileFont(filename, char_w=8, char_h=8, zooms=COMPILED_ZOOMS):
+    # font build step: writes the masks of all zoom levels next to the image
+    atlas = decodeAtlas(filename)
+    width, height = atlas.get_size()
+
+    planes = {}
+    for zoom in zooms:
+        size = (width * zoom, height * zoom)
+        zoomed = pygame.transform.scale(atlas, size) if zoom != 1 else atlas
+        planes[zoom] = size + (pygame.image.tobytes(zoomed, 'P'),)
+
+    compiled = fontfile.compiledName(filename)
+    fontfile.writeFontFile(compiled, filename, char_w, char_h, 32, width // char_w, planes)
+    _compiled.pop(filename, None)
+
+    return compiled
+
+
+def surfaceBytes(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+class SurfaceCache:
+    # least recently used surfaces, bounded by the memory of their pixels.
+    # the newest entry is always kept, even if it exceeds the budget alone
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, key):
+        surface = self.entries.get(key)
+
+        if surface is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+
+        return surface
+
+    def put(self, key, surface):
+        if key in self.entries:
+            self.bytes -= surfaceBytes(self.entries.pop(key))
+
+        self.entries[key] = surface
+        self.bytes += surfaceBytes(surface)
+
+        while self.bytes > self.maxBytes and len(self.entries) > 1:
+            _, old = self.entries.popitem(last=False)
+            self.bytes -= surfaceBytes(old)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.maxBytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                }
+
 
 class BitmapFont:
-    def __init__(self, filename, char_w=8, char_h=8, zoom=1, scr_w=320, scr_h=240):
+    def __init__(self, filename, char_w=8, char_h=8, zoom=1, scr_w=320, scr_h=240,
+                 textCacheBytes=TEXT_CACHE_BYTES):
         self.lastxpos, self.lastypos = 0, 0
 
         self.char_w = char_w
@@ -24,21 +171,17 @@ class BitmapFont:
         self.scr_w = scr_w
         self.scr_h = scr_h
 
-        self.fonts = {}
-
         self.lastcolor = (255, 255, 255)
 
-        self.font = pygame.image.load(filename)
-
         self.char_w *= zoom
         self.char_h *= zoom
 
-        self.textCache = {}
+        self.font = loadAtlas(filename, self.char_w * NUM_CHARS, self.char_h)
+
+        self.textCache = SurfaceCache(textCacheBytes)
 
-    def initColor(self, c):
-        f = pygame.transform.scale(self.font, (self.char_w * NUM_CHARS, self.char_h))
-        f.fill(c, special_flags=pygame.BLEND_MULT)
-        self.fonts[c] = f
+    def cacheStats(self):
+        return {'text': self.textCache.stats()}
 
     def drawText(self, output, text, x=None, y=None, fgcolor=None, bgcolor=None):
         if x is None:
@@ -58,35 +201,40 @@ class BitmapFont:
                                  (self.char_h))
                                  )
 
-        if fgcolor not in self.fonts:
-            self.initColor(fgcolor)
-
         if TEXT_CACHING:
-            key = (text, fgcolor, bgcolor)
+            # strings are cached as masks too, one entry serves every color
+            cacheSurface = self.textCache.get(text)
 
-            if key not in self.textCache:
-                cacheSurface = pygame.Surface((len(text) * self.char_w, self.char_h), flags=pygame.SRCALPHA)
+            if cacheSurface is None:
+                font = self.font
+                cacheSurface = pygame.Surface((len(text) * self.char_w, self.char_h), 0, 8)
+                cacheSurface.set_palette(font.get_palette())     # same palette, so glyphs are copied unmapped
+                cacheSurface.set_colorkey(0)
 
                 for i, c in enumerate(text):
                     grabx = (ord(c) - 32) * self.char_w
                     blitx = i * self.char_w
                     blity = (self.char_h - self.char_h + 1) / 2
 
-                    cacheSurface.blit(self.fonts[fgcolor], (blitx, blity), (grabx, 0, self.char_w, self.char_h))
-                    self.textCache[key] = cacheSurface
-            else:
-                cacheSurface = self.textCache[key]
+                    cacheSurface.blit(font, (blitx, blity), (grabx, 0, self.char_w, self.char_h))
+
+                self.textCache.put(text, cacheSurface)
+
+            cacheSurface.set_palette_at(GLYPH_INDEX, fgcolor)
 
             blitx = x * self.char_w
             blity = y * self.char_h + (self.char_h - self.char_h + 1) / 2
             output.blit(cacheSurface, (blitx, blity))
         else:
+            font = self.font
+            font.set_palette_at(GLYPH_INDEX, fgcolor)
+
             for i, c in enumerate(text):
                 grabx = (ord(c) - 32) * self.char_w
                 blitx = (x + i) * self.char_w
                 blity = y * self.char_h + (self.char_h - self.char_h + 1) / 2
 
-                output.blit(self.fonts[fgcolor], (blitx, blity), (grabx, 0, self.char_w, self.char_h))
+                output.blit(font, (blitx, blity), (grabx, 0, self.char_w, self.char_h))
 
         self.lastxpos = x
         self.lastypos = y + 1
@@ -111,3 +259,7 @@ class BitmapFont:
         if y is not None:
             self.lastypos += y
 
+
+if __name__ == '__main__':
+    for filename in sys.argv[1:] or ['gfx/heimatfont.png']:
+        print('compiled', compileFont(filename))
@@ -0,0 +1,386 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import deque
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+import game
+import hexgrid
+
+
+# -- bot players
+#
+# whenever a bot's player sets off on a new segment, the bot decides which
+# way to go at the end of it. the search runs in a worker process: iterative
+# deepening over the bot's own moves (same turn tables as Player.turn), the
+# positions are scored by voronoi territory, the free nodes the bot reaches
+# before any other player. at the time budget the search stops and answers
+# with the best move of the deepest finished iteration. answers come back
+# asynchronously and are applied through pressDirection() /
+# releaseDirection() like any other input
+
+TIME_BUDGET = 0.02      # seconds per decision
+MAX_DEPTH = 12
+CRASH_SCORE = -1000000
+CONTESTED_SCORE = -1000     # first step onto a node another player can step onto next
+
+def _buildMoves():
+    # turn state -> [(target mask, (dx, dy)), ...], one mask (with the fewest
+    # keys) for every step that can be steered into
+    moves = []
+    for state in range(36):
+        steps = {}
+        for mask in sorted(range(1, 16), key=lambda m: bin(m).count('1')):
+            step = game.TARGET_TURNS[state << 4 | mask]
+            if step is not None and step not in steps:
+                steps[step] = mask
+        moves.append([(mask, step) for step, mask in steps.items()])
+    return moves
+
+MOVES = _buildMoves()
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class BotSearch:
+    def __init__(self, width, height):
+        self.grid = grid = hexgrid.HexGrid(width, height)
+
+        # node -> neighbour nodes, as plain lists for fast traversal
+        self.neighbours = [[] for i in range(grid.numNodes)]
+        for node1, node2 in grid.segmentNodes.tolist():
+            self.neighbours[node1].append(node2)
+            self.neighbours[node2].append(node1)
+        self.steps = grid.nodeSegments.tolist()     # node -> segment index per directionIndex
+
+        self.deadline = 0.
+        self.owners = None
+        self.opponents = []
+
+    def blocked(self, x, y, tx, ty, claimed):
+        # HexGrid.isBlocked() against the snapshot plus the bot's own path
+        node = self.grid.nodeIndex(x, y)
+        if node < 0 or self.steps[node][hexgrid.directionIndex(tx - x, ty - y)] < 0:
+            return True
+        node = self.grid.nodeIndex(tx, ty)
+        return self.owners[node] != hexgrid.NO_OWNER or node in claimed
+
+    def territory(self, head, claimed):
+        # free nodes reached by the bot first minus those reached first by others
+        owners = self.owners
+        neighbours = self.neighbours
+
+        distance = {head: 0}
+        mine = {head}
+        frontier = [head]
+        for node in self.opponents:
+            if node not in distance:
+                distance[node] = 0
+                frontier.append(node)
+
+        d = 0
+        score = 0
+        while frontier:
+            if time.perf_counter() > self.deadline:
+                raise SearchTimeout()
+
+            d += 1
+            nextFrontier = []
+            for node in frontier:
+                isMine = node in mine
+                for n in neighbours[node]:
+                    if n in claimed or owners[n] != hexgrid.NO_OWNER:
+                        continue
+                    if n not in distance:
+                        distance[n] = d
+                        nextFrontier.append(n)
+                        if isMine:
+                            mine.add(n)
+                            score += 1
+                        else:
+                            score -= 1
+                    elif distance[n] == d and n in mine and not isMine:
+                        mine.discard(n)     # reached at the same time, nobody's
+                        score -= 1
+            frontier = nextFrontier
+
+        return score
+
+    def search(self, x, y, nx, ny, claimed, depth):
+        # value of traveling (x, y) -> (nx, ny), with claimed the nodes of the path so far
+        if time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+        if depth == 0:
+            return self.territory(self.grid.nodeIndex(nx, ny), claimed)
+
+        node = self.grid.nodeIndex(nx, ny)
+        claimed.add(node)
+
+        best = CRASH_SCORE - depth      # crashing later is better than crashing now
+        for mask, (dx, dy) in MOVES[game.turnState(x, y, nx, ny)]:
+            if not self.blocked(nx, ny, nx + dx, ny + dy, claimed):
+                best = max(best, self.search(nx, ny, nx + dx, ny + dy, claimed, depth - 1))
+
+        claimed.discard(node)
+        return best
+
+    def decide(self, owners, players, number, budget=TIME_BUDGET, maxDepth=MAX_DEPTH):
+        # returns (target mask, depth of the deepest finished iteration).
+        # without a budget the search always goes to maxDepth, so the same
+        # position always gives the same move
+        self.deadline = time.perf_counter() + budget if budget is not None else float('inf')
+        self.owners = owners
+
+        x, y, nx, ny, crashed = players[number]
+        self.opponents = [self.grid.nodeIndex(px, py) for i, (ox, oy, px, py, c) in enumerate(players)
+                          if i != number and not c and self.grid.nodeIndex(px, py) >= 0]
+
+        # the nodes other players are on or heading to count as taken
+        claimed = {self.grid.nodeIndex(x, y), self.grid.nodeIndex(nx, ny)}
+        for i, (ox, oy, px, py, c) in enumerate(players):
+            if i != number:
+                claimed.update((self.grid.nodeIndex(ox, oy), self.grid.nodeIndex(px, py)))
+
+        contested = set()
+        for i, (ox, oy, px, py, c) in enumerate(players):
+            if i != number and not c:
+                contested.update((px + dx, py + dy) for mask, (dx, dy) in MOVES[game.turnState(ox, oy, px, py)])
+
+        moves = [(mask, nx + dx, ny + dy) for mask, (dx, dy) in MOVES[game.turnState(x, y, nx, ny)]]
+        open_ = [(mask, tx, ty) for mask, tx, ty in moves if not self.blocked(nx, ny, tx, ty, claimed)]
+        penalties = [CONTESTED_SCORE if (tx, ty) in contested else 0 for mask, tx, ty in open_]
+
+        if not open_:
+            return moves[0][0], 0
+        if len(open_) == 1:
+            return open_[0][0], 0
+
+        bestMask, bestDepth = open_[penalties.index(max(penalties))][0], 0
+
+        try:
+            for depth in range(maxDepth):
+                scores = [self.search(nx, ny, tx, ty, claimed, depth) + penalty
+                          for (mask, tx, ty), penalty in zip(open_, penalties)]
+                bestMask = open_[scores.index(max(scores))][0]
+                bestDepth = depth + 1
+        except SearchTimeout:
+            pass
+
+        return bestMask, bestDepth
+
+
+def _worker(requests, answers):
+    searches = {}
+
+    while True:
+        try:
+            message = requests.recv()
+        except (EOFError, OSError):     # the game is gone
+            break
+        if message is None:
+            break
+
+        requestId, number, width, height, owners, players, budget = message
+
+        search = searches.get((width, height))
+        if search is None:
+            search = searches[(width, height)] = BotSearch(width, height)
+
+        start = time.perf_counter()
+        mask, depth = search.decide(np.frombuffer(owners, dtype=np.int16).tolist(), players, number, budget)
+        try:
+            answers.send((requestId, number, mask, depth, time.perf_counter() - start))
+        except OSError:     # the game closed its end while we were searching
+            break
+
+
+# -- game side
+#
+# update() is called once per frame. it hands out requests for bots that
+# started a new segment and turns answers into input events. answers for a
+# segment the player has already left are dropped.
+#
+# the worker is 'python3 bot.py --worker', talking over its stdin and
+# stdout. unlike a multiprocessing child it never imports the game's main
+# module again. when the worker dies, the bots stop and their players are
+# left to humans
+
+class BotPlayers:
+    def __init__(self, numbers, budget=TIME_BUDGET):
+        self.numbers = list(numbers)
+        self.budget = budget
+
+        self.process = subprocess.Popen([sys.executable, __file__, '--worker'],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        # the connections get their own descriptors, the pipe files are closed
+        self.toWorker = Connection(os.dup(self.process.stdin.fileno()), readable=False)
+        self.fromWorker = Connection(os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdin.close()
+        self.process.stdout.close()
+        self.failed = False
+
+        self.segments = {}      # player number -> segment of the pending request
+        self.requests = {}      # player number -> id of the pending request
+        self.nextRequestId = 0
+
+        self.decisions = 0
+        self.late = 0
+        self.decisionTimes = deque(maxlen=1024)
+
+    def takeOver(self, number):
+        # a human pressed this player's keys
+        if number in self.numbers:
+            self.numbers.remove(number)
+            return True
+        return False
+
+    def update(self, grid, players):
+        try:
+            return self._update(grid, players)
+        except (EOFError, OSError):
+            self.failed = True
+            self.numbers = []
+            return []
+
+    def _update(self, grid, players):
+        events = []
+
+        while self.fromWorker.poll():
+            requestId, number, mask, depth, elapsed = self.fromWorker.recv()
+            self.decisionTimes.append(elapsed)
+
+            if number not in self.numbers or self.requests.get(number) != requestId:
+                self.late += 1
+                continue
+
+            self.decisions += 1
+            player = players[number]
+            for d in range(4):
+                pressed = bool(mask & 1 << d)
+                if pressed != player.input_right_left_down_up[d] or (pressed and player.idle):
+                    events.append((number, d, pressed))
+
+        snapshot = None
+
+        for number in self.numbers:
+            player = players[number]
+            segment = (player.x, player.y, player.nextx, player.nexty)
+
+            if player.crashed or self.segments.get(number) == segment:
+                continue
+
+            if snapshot is None:
+                snapshot = [(p.x, p.y, p.nextx, p.nexty, p.crashed) for p in players]
+                owners = grid.nodeOwner.tobytes()
+
+            self.segments[number] = segment
+            self.requests[number] = self.nextRequestId
+            self.toWorker.send((self.nextRequestId, number, grid.width, grid.height, owners, snapshot, self.budget))
+            self.nextRequestId += 1
+
+        return events
+
+    def stats(self):
+        times = sorted(self.decisionTimes)
+        return {'decisions': self.decisions,
+                'late': self.late,
+                'decision_mean_ms': statistics.fmean(times) * 1000 if times else 0,
+                'decision_max_ms': times[-1] * 1000 if times else 0,
+                }
+
+    def close(self):
+        try:
+            self.toWorker.send(None)
+        except OSError:
+            pass
+        self.toWorker.close()
+        self.fromWorker.close()
+
+        try:
+            self.process.wait(1)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+# -- benchmark: bots playing each other headless, decisions in process
+
+def benchmark(games, numPlayers, budget, width=11, height=40):
+    search = BotSearch(width, height)
+    spawns = game.spawnPoints(width, height)[:numPlayers]
+
+    times = []
+    depths = []
+    rounds = []
+
+    for g in range(games):
+        grid = hexgrid.HexGrid(width, height)
+        players = [game.Player(x, y, grid=grid, number=i) for i, (x, y) in enumerate(spawns)]
+        segments = [None] * numPlayers
+
+        ticks = 0
+        while not game.roundOver(players) and ticks < 100000:
+            for i, player in enumerate(players):
+                segment = (player.x, player.y, player.nextx, player.nexty)
+                if player.crashed or segments[i] == segment:
+                    continue
+                segments[i] = segment
+
+                snapshot = [(p.x, p.y, p.nextx, p.nexty, p.crashed) for p in players]
+                start = time.perf_counter()
+                mask, depth = search.decide(grid.nodeOwner.tolist(), snapshot, i, budget)
+                times.append(time.perf_counter() - start)
+                depths.append(depth)
+
+                for d in range(4):
+                    if mask & 1 << d:
+                        player.pressDirection(d)
+                    else:
+                        player.releaseDirection(d)
+
+            game.updatePlayers(players)
+            ticks += 1
+
+        rounds.append(ticks)
+
+    times.sort()
+    return {'games': games,
+            'players': numPlayers,
+            'budget_ms': budget * 1000,
+            'decisions': len(times),
+            'decisions_per_s': len(times) / sum(times),
+            'decision_mean_ms': statistics.fmean(times) * 1000,
+            'decision_p99_ms': times[min(len(times) - 1, int(len(times) * 0.99))] * 1000,
+            'decision_max_ms': times[-1] * 1000,
+            'mean_depth': statistics.fmean(depths),
+            'mean_round_ticks': statistics.fmean(rounds),
+            }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='bot players benchmark (decisions per second per bot)')
+    parser.add_argument('--games', type=int, default=10)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--budget', type=float, default=TIME_BUDGET, help='seconds per decision')
+    parser.add_argument('--worker', action='store_true', help='run as the search worker of BotPlayers (stdin/stdout)')
+    args = parser.parse_args()
+
+    if args.worker:
+        requests = Connection(os.dup(sys.stdin.fileno()), writable=False)
+        answers = Connection(os.dup(sys.stdout.fileno()), readable=False)
+        sys.stdout = sys.stderr     # nothing else may write into the answers
+        _worker(requests, answers)
+        sys.exit()
+
+    stats = benchmark(args.games, args.players, args.budget)
+    print('%(games)d games, %(players)d bots, %(budget_ms).0f ms budget: %(decisions)d decisions, '
+          '%(decisions_per_s).1f decisions/s per bot, %(decision_mean_ms).2f ms mean, '
+          '%(decision_p99_ms).2f ms p99, %(decision_max_ms).2f ms max, depth %(mean_depth).1f, '
+          '%(mean_round_ticks).0f ticks per round' % stats)
@@ -0,0 +1,144 @@
+import os
+import queue
+import struct
+import threading
+import zlib
+
+import numpy as np
+import pygame
+
+
+# -- frame capture
+#
+# compose() hands every finished frame to submit(), which copies it into a
+# free buffer of a fixed pool and queues it. a writer thread drains the
+# queue and hands the buffer back to the pool. when the writer falls behind
+# and no buffer is free, the frame is dropped and counted, the game loop
+# never waits. buffers are allocated once, on the first frame.
+#
+# frames are written as a png sequence into a directory, or appended to a
+# raw rgb24 video file (path ending in .rgb or .raw). pngs are encoded here
+# with zlib rather than pygame.image.save(), which holds the gil for the
+# whole encode and would stall the game loop. png files are numbered by
+# frame, dropped frames leave gaps in the numbering
+
+CAPTURE_QUEUE = 8           # frames buffered between the game loop and the writer
+PNG_COMPRESSION = 1         # zlib level, the frames are simple and compress well even at 1
+
+RAW_EXTENSIONS = ('.rgb', '.raw')
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def writePngChunk(f, tag, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(tag)
+    f.write(data)
+    f.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(tag))))
+
+
+class FrameCapture:
+    def __init__(self, path, queueSize=CAPTURE_QUEUE, compression=PNG_COMPRESSION):
+        self.path = path
+        self.raw = os.path.splitext(path)[1].lower() in RAW_EXTENSIONS
+        self.queueSize = queueSize
+        self.compression = compression
+
+        if self.raw:
+            self.file = open(path, 'wb', buffering=0)
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.file = None
+
+        self.size = None
+        self.free = queue.Queue()
+        self.filled = queue.Queue()
+
+        self.frameNumber = 0
+        self.framesWritten = 0
+        self.framesDropped = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _allocate(self, size):
+        width, height = size
+        self.size = size
+
+        # png rows start with their filter type byte (0), the pixels of a
+        # buffer are a view next to that column
+        for i in range(self.queueSize):
+            if self.raw:
+                buffer = np.zeros((height, width * 3), dtype=np.uint8)
+            else:
+                buffer = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+            self.free.put(buffer)
+
+        self.header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)     # 8 bit rgb
+
+    def _pixels(self, buffer):
+        width, height = self.size
+        rows = buffer if self.raw else buffer[:, 1:]
+        return rows.reshape(height, width, 3)
+
+    def submit(self, surface):
+        if self.size is None:
+            self._allocate(surface.get_size())
+
+        frameNumber = self.frameNumber
+        self.frameNumber += 1
+
+        if surface.get_size() != self.size:
+            self.framesDropped += 1
+            return
+
+        try:
+            buffer = self.free.get_nowait()
+        except queue.Empty:
+            self.framesDropped += 1
+            return
+
+        pixels = pygame.surfarray.pixels3d(surface)
+        np.copyto(self._pixels(buffer), pixels.transpose(1, 0, 2))
+        del pixels      # releases the surface lock
+
+        self.filled.put((frameNumber, buffer))
+
+    def close(self):
+        self.filled.put(None)
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+
+    def stats(self):
+        return {'frames': self.frameNumber,
+                'written': self.framesWritten,
+                'dropped': self.framesDropped,
+                }
+
+    def _run(self):
+        while True:
+            item = self.filled.get()
+            if item is None:
+                break
+
+            frameNumber, buffer = item
+
+            try:
+                if self.raw:
+                    self.file.write(buffer)
+                else:
+                    self._writePng(frameNumber, buffer)
+                self.framesWritten += 1
+            except OSError:
+                self.framesDropped += 1
+            finally:
+                self.free.put(buffer)
+
+    def _writePng(self, frameNumber, buffer):
+        data = zlib.compress(buffer, self.compression)     # releases the gil while compressing
+
+        with open(os.path.join(self.path, 'frame_%06d.png' % frameNumber), 'wb') as f:
+            f.write(PNG_SIGNATURE)
+            writePngChunk(f, b'IHDR', self.header)
+            writePngChunk(f, b'IDAT', data)
+            writePngChunk(f, b'IEND', b'')
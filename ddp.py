@@ -0,0 +1,261 @@
+import argparse
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+import pygame
+
+
+# -- ddp (distributed display protocol) led output
+#
+# frames are sent as 24 bit rgb over udp. every packet starts with a 10 byte
+# header (flags, sequence, data type, destination, data offset, data length),
+# followed by a 4 byte timecode if the TIMECODE flag is set. the last packet
+# of a frame has the PUSH flag set, receivers show the frame when it arrives.
+#
+# the timecode field carries the microseconds of time.monotonic() when the
+# frame was submitted, so a receiver on the same machine can measure latency
+
+DDP_PORT = 4048
+
+FLAG_VERSION = 0x40
+FLAG_TIMECODE = 0x10
+FLAG_PUSH = 0x01
+
+DATA_TYPE_RGB24 = 0x0b
+DESTINATION_DISPLAY = 1
+
+HEADER = struct.Struct('!BBBBIHI')      # including the timecode
+MAX_PIXELS_PER_PACKET = 480             # 1440 bytes of payload
+DELTA_MERGE_GAP = 16                    # unchanged pixels bridged between two changed runs
+
+
+def timecode():
+    return (time.monotonic_ns() // 1000) & 0xffffffff
+
+def changedRuns(current, previous, mergeGap=DELTA_MERGE_GAP):
+    # (start, end) pixel ranges that differ, runs closer than mergeGap are joined
+    changed = (current != previous).any(axis=1)
+    if not changed.any():
+        return []
+
+    edges = np.flatnonzero(np.diff(changed.astype(np.int8), prepend=0, append=0)).tolist()
+
+    runs = []
+    for start, end in zip(edges[0::2], edges[1::2]):
+        if runs and start - runs[-1][1] <= mergeGap:
+            runs[-1][1] = end
+        else:
+            runs.append([start, end])
+
+    return runs
+
+
+class DdpSender:
+    def __init__(self, host, port=DDP_PORT, width=256, height=320, delta=True, keyframeInterval=60):
+        self.address = (host, port)
+        self.width = width
+        self.height = height
+        self.delta = delta
+        self.keyframeInterval = keyframeInterval
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+        # the game thread copies into pending, the sender thread swaps it
+        # with sending. frames not picked up in time are replaced
+        self.pending = np.zeros((height, width, 3), dtype=np.uint8)
+        self.sending = np.zeros((height, width, 3), dtype=np.uint8)
+        self.previous = np.zeros((height * width, 3), dtype=np.uint8)
+        self.pendingTimecode = 0
+        self.hasPending = False
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.running = True
+
+        self.sequence = 1
+        self.framesSubmitted = 0
+        self.framesSent = 0
+        self.framesReplaced = 0
+        self.packetsSent = 0
+        self.bytesSent = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, surface):
+        # pixels3d is a view of the surface memory, the only copy made here
+        # goes straight into the pending send buffer
+        pixels = pygame.surfarray.pixels3d(surface)
+
+        with self.lock:
+            np.copyto(self.pending, pixels.transpose(1, 0, 2))
+            self.pendingTimecode = timecode()
+            if self.hasPending:
+                self.framesReplaced += 1
+            self.hasPending = True
+
+        del pixels
+        self.framesSubmitted += 1
+        self.wakeup.set()
+
+    def stop(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join()
+        self.socket.close()
+
+    def _run(self):
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+            if not self.running:
+                break
+
+            with self.lock:
+                if not self.hasPending:
+                    continue
+                self.pending, self.sending = self.sending, self.pending
+                frameTimecode = self.pendingTimecode
+                self.hasPending = False
+
+            try:
+                self._sendFrame(self.sending.reshape(-1, 3), frameTimecode)
+            except OSError:
+                pass    # receiver not reachable, try again with the next frame
+
+    def _sendFrame(self, pixels, frameTimecode):
+        if self.delta and self.framesSent % self.keyframeInterval:
+            runs = changedRuns(pixels, self.previous)
+        else:
+            runs = [(0, len(pixels))]
+
+        data = pixels.reshape(-1)
+        chunks = []
+        for start, end in runs:
+            for chunkStart in range(start, end, MAX_PIXELS_PER_PACKET):
+                chunks.append((chunkStart, min(chunkStart + MAX_PIXELS_PER_PACKET, end)))
+
+        if not chunks:
+            chunks.append((0, 0))   # nothing changed, push the unchanged frame
+
+        for i, (start, end) in enumerate(chunks):
+            flags = FLAG_VERSION | FLAG_TIMECODE
+            if i == len(chunks) - 1:
+                flags |= FLAG_PUSH
+
+            payload = data[start * 3:end * 3]
+            header = HEADER.pack(flags, self.sequence, DATA_TYPE_RGB24, DESTINATION_DISPLAY,
+                                 start * 3, len(payload), frameTimecode)
+
+            self.socket.sendto(header + payload.tobytes(), self.address)
+
+            self.packetsSent += 1
+            self.bytesSent += HEADER.size + len(payload)
+
+        self.sequence = self.sequence % 15 + 1     # 1..15, 0 means unused
+        self.previous[:] = pixels
+        self.framesSent += 1
+
+
+# -- local stand-in for the led controllers
+
+class DdpReceiver:
+    def __init__(self, port=DDP_PORT, width=256, height=320, host='127.0.0.1'):
+        self.width = width
+        self.height = height
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)   # a full frame is a burst of 171 packets
+        self.socket.bind((host, port))
+        self.socket.settimeout(0.1)
+
+        self.frame = bytearray(width * height * 3)
+
+        self.frames = 0
+        self.packets = 0
+        self.bytes = 0
+        self.latencies = []
+
+    def receive(self):
+        # handles one packet, returns True when a frame was completed
+        try:
+            packet = self.socket.recv(65536)
+        except socket.timeout:
+            return False
+
+        self.packets += 1
+        self.bytes += len(packet)
+
+        flags = packet[0]
+        headerSize = HEADER.size if flags & FLAG_TIMECODE else HEADER.size - 4
+        flags, sequence, dataType, destination, offset, length = struct.unpack_from('!BBBBIH', packet)
+
+        self.frame[offset:offset + length] = packet[headerSize:headerSize + length]
+
+        if flags & FLAG_PUSH:
+            if flags & FLAG_TIMECODE:
+                sent = struct.unpack_from('!I', packet, 10)[0]
+                self.latencies.append(((timecode() - sent) & 0xffffffff) / 1000)
+            self.frames += 1
+            return True
+
+        return False
+
+    def takeStats(self, elapsed):
+        latencies = sorted(self.latencies)
+        stats = {'fps': self.frames / elapsed,
+                 'packets_per_s': self.packets / elapsed,
+                 'kbytes_per_s': self.bytes / elapsed / 1024,
+                 'latency_mean_ms': sum(latencies) / len(latencies) if latencies else 0,
+                 'latency_max_ms': latencies[-1] if latencies else 0,
+                 }
+
+        self.frames = self.packets = self.bytes = 0
+        self.latencies.clear()
+
+        return stats
+
+    def close(self):
+        self.socket.close()
+
+
+def runReceiver(port, width, height, show=False):
+    receiver = DdpReceiver(port, width, height)
+
+    if show:
+        window = pygame.display.set_mode((width, height), flags=pygame.SCALED)
+
+    last = time.monotonic()
+
+    try:
+        while True:
+            if receiver.receive() and show:
+                pygame.event.pump()
+                window.blit(pygame.image.frombuffer(receiver.frame, (width, height), 'RGB'), (0, 0))
+                pygame.display.flip()
+
+            now = time.monotonic()
+            if now - last >= 1:
+                stats = receiver.takeStats(now - last)
+                print('%(fps)5.1f fps  %(packets_per_s)7.1f packets/s  %(kbytes_per_s)8.1f kB/s  '
+                      'latency %(latency_mean_ms)6.2f ms (max %(latency_max_ms)6.2f ms)' % stats)
+                last = now
+    except KeyboardInterrupt:
+        pass
+
+    receiver.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='local ddp receiver, stands in for the led wall controllers')
+    parser.add_argument('--port', type=int, default=DDP_PORT)
+    parser.add_argument('--width', type=int, default=256)
+    parser.add_argument('--height', type=int, default=320)
+    parser.add_argument('--show', action='store_true', help='show the received frames in a window')
+    args = parser.parse_args()
+
+    runReceiver(args.port, args.width, args.height, args.show)
@@ -0,0 +1,140 @@
+import hashlib
+import mmap
+import os
+import struct
+
+
+# -- precompiled bitmap fonts
+#
+# a .hxf file holds a font's glyph atlas pre-zoomed for several zoom levels
+# as 8 bit masks (0 = background, 1 = glyph, the palette indices of
+# bitmapfont.loadAtlas()), plus the metrics. the file is memory mapped and
+# the masks are handed out as memoryviews, bitmapfont wraps them as
+# surfaces without decoding or copying. reading the metrics needs neither
+# pygame nor numpy.
+#
+# layout: header, one entry per zoom level, the ink bounds (first and last
+# column + 1 of every glyph at zoom 1, 0 0 for empty glyphs), then the
+# masks, each aligned to PLANE_ALIGN bytes. the header carries the sha1 of
+# the source image, a compiled file that no longer matches is ignored
+#
+# build with: python3 bitmapfont.py gfx/heimatfont.png
+
+MAGIC = b'HXFN'
+VERSION = 1
+
+HEADER = struct.Struct('<4sBBHHHH20s')     # magic, version, zoom levels, chars, first char, char w, char h, source sha1
+ZOOM = struct.Struct('<HHHxxI')             # zoom, atlas width, atlas height, offset of the mask
+PLANE_ALIGN = 16
+
+EXTENSION = '.hxf'
+
+
+def compiledName(filename):
+    return os.path.splitext(filename)[0] + EXTENSION
+
+def sourceHash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha1(f.read()).digest()
+
+
+class FontFile:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            # copy on write, pages are shared with the page cache until written
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+        magic, version, numZooms, self.numChars, self.firstChar, self.charW, self.charH, self.sourceHash = \
+            HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a compiled font' % filename)
+
+        # a truncated file still has a valid header, everything it points
+        # to has to be inside the file
+        self.planes = {}    # zoom -> (width, height, offset)
+        offset = HEADER.size
+        for i in range(numZooms):
+            zoom, width, height, planeOffset = ZOOM.unpack_from(self.map, offset)
+            if planeOffset + width * height > len(self.map):
+                raise ValueError('%s is truncated' % filename)
+            self.planes[zoom] = (width, height, planeOffset)
+            offset += ZOOM.size
+
+        self.boundsOffset = offset
+        if self.boundsOffset + self.numChars * 2 > len(self.map):
+            raise ValueError('%s is truncated' % filename)
+
+    def zooms(self):
+        return sorted(self.planes)
+
+    def plane(self, zoom):
+        # (width, height, mask) with the mask a memoryview into the file, or None
+        if zoom not in self.planes:
+            return None
+        width, height, offset = self.planes[zoom]
+        return width, height, memoryview(self.map)[offset:offset + width * height]
+
+    def planeBySize(self, width, height):
+        for zoom, (w, h, offset) in self.planes.items():
+            if (w, h) == (width, height):
+                return self.plane(zoom)
+        return None
+
+    def glyphBounds(self, c):
+        # first and last ink column + 1 of a character at zoom 1
+        i = ord(c) - self.firstChar
+        if not 0 <= i < self.numChars:
+            return 0, 0
+        return self.map[self.boundsOffset + i * 2], self.map[self.boundsOffset + i * 2 + 1]
+
+    def textSize(self, text, zoom=1):
+        return len(text) * self.charW * zoom, self.charH * zoom
+
+
+def writeFontFile(filename, source, charW, charH, firstChar, numChars, planes):
+    # planes is {zoom: (width, height, mask bytes)}, zoom 1 is required for
+    # the ink bounds
+    width, height, mask = planes[1]
+
+    bounds = bytearray()
+    for i in range(numChars):
+        columns = [x for x in range(i * charW, (i + 1) * charW)
+                   if any(mask[y * width + x] for y in range(height))]
+        if columns:
+            bounds += bytes((columns[0] - i * charW, columns[-1] - i * charW + 1))
+        else:
+            bounds += bytes((0, 0))
+
+    offset = HEADER.size + ZOOM.size * len(planes) + len(bounds)
+    entries = []
+    for zoom in sorted(planes):
+        offset += -offset % PLANE_ALIGN
+        entries.append((zoom, offset))
+        w, h, data = planes[zoom]
+        offset += w * h
+
+    with open(filename, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(planes), numChars, firstChar, charW, charH, sourceHash(source)))
+        for zoom, planeOffset in entries:
+            f.write(ZOOM.pack(zoom, planes[zoom][0], planes[zoom][1], planeOffset))
+        f.write(bounds)
+
+        for zoom, planeOffset in entries:
+            f.write(bytes(planeOffset - f.tell()))
+            f.write(planes[zoom][2])
+
+def openCompiled(filename):
+    # the compiled font next to filename, if there is one and it is current
+    compiled = compiledName(filename)
+    if not os.path.exists(compiled):
+        return None
+
+    try:
+        fontFile = FontFile(compiled)
+    except (ValueError, struct.error):
+        return None
+
+    if fontFile.sourceHash != sourceHash(filename):
+        return None
+
+    return fontFile
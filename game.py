@@ -0,0 +1,395 @@
+import hashlib
+import struct
+
+import hexgrid
+
+
+VERIFY_TURNS = False    # check every turn table lookup against referenceTurn()
+
+RIGHT, LEFT, DOWN, UP = range(4)    # directions of Player.pressDirection()
+
+
+def spawnPoints(width, height):
+    return [(4, 12),
+            (width - 4, height - 12),
+            (width - 4, 12),
+            (4, height - 12),
+            ]
+
+
+class Player:
+    def __init__(self, x, y, color=(255, 255, 255), grid=None, number=0):
+        self.speed = 1.0 / 32
+
+        self.racecar = False
+        self.input_right_left_down_up = [False, False, False, False]
+
+        self.color = color
+        self.grid = grid
+        self.number = number    # owner id in the grid's occupancy index
+
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        # back to a spawn point for a new round, held input is kept
+        self.x = x
+        self.y = y
+
+        self.nextx = x
+        self.nexty = y + 1
+
+        self.dist = 0
+        self.nextdir = 1        # for racecar steering only
+
+        self.idle = True
+        self.crashed = False
+
+        self.target_right_left_down_up = [True, False, False, False]
+
+
+    def pressLeft(self):
+        self.nextdir = -1
+        self.input_right_left_down_up[1] = True
+        self.idle = False
+
+    def pressRight(self):
+        self.nextdir = 1
+        self.input_right_left_down_up[0] = True
+        self.idle = False
+
+    def pressUp(self):
+        self.input_right_left_down_up[3] = True
+        self.idle = False
+
+    def pressDown(self):
+        self.input_right_left_down_up[2] = True
+        self.idle = False
+
+    def pressDirection(self, d):
+        (self.pressRight,
+         self.pressLeft,
+         self.pressDown,
+         self.pressUp)[d]()
+
+
+    def releaseLeft(self):
+        self.input_right_left_down_up[1] = False
+
+    def releaseRight(self):
+        self.input_right_left_down_up[0] = False
+
+    def releaseUp(self):
+        self.input_right_left_down_up[3] = False
+
+    def releaseDown(self):
+        self.input_right_left_down_up[2] = False
+
+    def releaseDirection(self, d):
+        (self.releaseRight,
+         self.releaseLeft,
+         self.releaseDown,
+         self.releaseUp)[d]()
+
+
+    def turn(self):
+        grid = self.grid
+
+        if grid is not None:
+            # the node ahead was free when we set off, but may have been taken since
+            if grid.isBlocked((self.x, self.y), (self.nextx, self.nexty)):
+                self.crashed = True
+                return
+
+            grid.setSegmentColor((self.x, self.y), (self.nextx, self.nexty), self.color, self.number)
+
+        state = turnState(self.x, self.y, self.nextx, self.nexty)
+
+        if not self.racecar:
+            t = self.target_right_left_down_up
+            dirx, diry = TARGET_TURNS[state << 4 | t[0] | t[1] << 1 | t[2] << 2 | t[3] << 3]
+        else:
+            dirx, diry = RACECAR_TURNS[state << 1 | (self.nextdir == 1)]
+
+        if VERIFY_TURNS:
+            expected = referenceTurn(self.x, self.y, self.nextx, self.nexty,
+                                     self.target_right_left_down_up, self.nextdir, self.racecar)
+            assert (dirx, diry) == expected, 'turn table mismatch at %s: %s != %s' % (
+                (self.x, self.y, self.nextx, self.nexty), (dirx, diry), expected)
+
+        self.x = self.nextx
+        self.y = self.nexty
+
+        self.nextx += dirx
+        self.nexty += diry
+
+        self.dist = 0
+
+        if grid is not None and grid.isBlocked((self.x, self.y), (self.nextx, self.nexty)):
+            self.crashed = True
+
+
+def stateHash(grid, players):
+    # sha1 over segment colors and player positions, to tell whether two
+    # runs of the simulation ended in the same state
+    h = hashlib.sha1(grid.colors.tobytes())
+    for player in players:
+        h.update(struct.pack('<iiiid', player.x, player.y, player.nextx, player.nexty, player.dist))
+    return h.digest()
+
+def roundOver(players):
+    # everybody crashed, or all but one in a multiplayer game
+    alive = sum(not player.crashed for player in players)
+    return alive < len(players) and alive <= 1
+
+def updatePlayers(players):
+    for player in players:
+        if True in player.input_right_left_down_up: player.target_right_left_down_up = list(player.input_right_left_down_up)
+
+        if not player.idle and not player.crashed:
+            player.dist += player.speed
+            if player.dist >= 1.0:
+                player.turn()
+
+
+# -- turning rules
+#
+# the next step only depends on the line of the current point (y % 4), the
+# step the player arrived with, and the steering input (target directions,
+# or nextdir for racecar steering). both tables are built from
+# referenceTurn() at import, turn() then does a single lookup.
+#
+# TARGET_TURNS is indexed by turnState() << 4 | target bit mask (right = 1,
+# left = 2, down = 4, up = 8), RACECAR_TURNS by turnState() << 1 | (nextdir == 1).
+# entries for steps that do not exist on the grid are None
+
+def turnState(x, y, nextx, nexty):
+    return (nexty % 4) * 9 + (nextx - x + 1) * 3 + (nexty - y + 1)
+
+def referenceTurn(x, y, nextx, nexty, target_right_left_down_up, nextdir, racecar):
+    #x=0 : x=1   : x=2
+    #    :       :
+    #    : |     :
+    #    :/ \    :/         y=0
+    # \ /:    \ /:
+    #  | :     | .          y=1
+    #  | :     | .
+    #  | :     |            y=2
+    # / \:    / \
+    #    :\ /               y=3
+    #    : |
+
+    line = nexty % 4   # y-line of target (=current) point
+
+    downwards = nexty - y > 0     # whether player came to current point by going down or not
+    rightside = nextx == x        # whether player was traveling on the right half of the hexagon (including middle - see sketch)
+
+    if not racecar:
+
+        neighbours = [(nextx, nexty-1), (nextx, nexty+1)]
+        if   line == 0: neighbours.append((nextx-1, nexty+1))
+        elif line == 1: neighbours.append((nextx+1, nexty-1))
+        elif line == 2: neighbours.append((nextx+1, nexty+1))
+        else:           neighbours.append((nextx-1, nexty-1))
+        neighbours.remove((x, y))
+
+        nextxScreenCoord, nextyScreenCoord = hexgrid.getScreenCoords(nextx, nexty, 1, 1)
+        i0_x, i0_y = hexgrid.getScreenCoords(neighbours[0][0], neighbours[0][1], 1, 1)
+        i1_x, i1_y = hexgrid.getScreenCoords(neighbours[1][0], neighbours[1][1], 1, 1)
+        i0_right = i0_x > nextxScreenCoord
+        i0_left  = i0_x < nextxScreenCoord
+        i0_down  = i0_y > nextyScreenCoord
+        i0_up    = i0_y < nextyScreenCoord
+        i1_right = i1_x > nextxScreenCoord
+        i1_left  = i1_x < nextxScreenCoord
+        i1_down  = i1_y > nextyScreenCoord
+        i1_up    = i1_y < nextyScreenCoord
+
+        i0_score = 0
+        if target_right_left_down_up[0] and i0_right: i0_score += 1
+        if target_right_left_down_up[1] and i0_left: i0_score += 1
+        if target_right_left_down_up[2] and i0_down: i0_score += 1
+        if target_right_left_down_up[3] and i0_up: i0_score += 1
+        if target_right_left_down_up[0] and i0_left: i0_score -= 1
+        if target_right_left_down_up[1] and i0_right: i0_score -= 1
+        if target_right_left_down_up[2] and i0_up: i0_score -= 1
+        if target_right_left_down_up[3] and i0_down: i0_score -= 1
+        i1_score = 0
+        if target_right_left_down_up[0] and i1_right: i1_score += 1
+        if target_right_left_down_up[1] and i1_left: i1_score += 1
+        if target_right_left_down_up[2] and i1_down: i1_score += 1
+        if target_right_left_down_up[3] and i1_up: i1_score += 1
+        if target_right_left_down_up[0] and i1_left: i1_score -= 1
+        if target_right_left_down_up[1] and i1_right: i1_score -= 1
+        if target_right_left_down_up[2] and i1_up: i1_score -= 1
+        if target_right_left_down_up[3] and i1_down: i1_score -= 1
+        neighbour_i = 0 if i0_score > i1_score else 1
+
+        dirx = neighbours[neighbour_i][0] - nextx
+        diry = neighbours[neighbour_i][1] - nexty
+
+    else: # racecar
+
+        if nextdir == -1:  # turn left
+            if line == 0:
+                if downwards:
+                    dirx = 0
+                    diry = 1
+                else:
+                    if rightside:
+                        dirx = -1
+                        diry = 1
+                    else:
+                        dirx = 0
+                        diry = -1
+
+            elif line == 1:
+                if downwards:
+                    if rightside:
+                        dirx = 1
+                        diry = -1
+                    else:
+                        dirx = 0
+                        diry = 1
+                else:
+                    dirx = 0
+                    diry = -1
+
+            elif line == 2:
+                if downwards:
+                    dirx = 1
+                    diry = 1
+                else:
+                    if rightside:
+                        dirx = 0
+                        diry = -1
+                    else:
+                        dirx = 0
+                        diry = 1
+
+            elif line == 3:
+                if downwards:
+                    if rightside:
+                        dirx = 0
+                        diry = 1
+                    else:
+                        dirx = 0
+                        diry = -1
+                else:
+                    dirx = -1
+                    diry = -1
+
+        elif nextdir == 1: # turn right
+            if line == 0:
+                if downwards:
+                    dirx = -1
+                    diry = 1
+                else:
+                    if rightside:
+                        dirx = 0
+                        diry = -1
+                    else:
+                        dirx = 0
+                        diry = 1
+
+            elif line == 1:
+                if downwards:
+                    if rightside:
+                        dirx = 0
+                        diry = 1
+                    else:
+                        dirx = 0
+                        diry = -1
+                else:
+                    dirx = 1
+                    diry = -1
+
+            elif line == 2:
+                if downwards:
+                    dirx = 0
+                    diry = 1
+                else:
+                    if rightside:
+                        dirx = 1
+                        diry = 1
+                    else:
+                        dirx = 0
+                        diry = -1
+
+            elif line == 3:
+                if downwards:
+                    if rightside:
+                        dirx = -1
+                        diry = -1
+                    else:
+                        dirx = 0
+                        diry = 1
+                else:
+                    dirx = 0
+                    diry = -1
+
+    return dirx, diry
+
+def incomingSteps(line):
+    # steps (dx, dy) by which a point on the given line can be reached
+    steps = [(0, 1), (0, -1)]
+    if   line == 0: steps.append((1, -1))
+    elif line == 1: steps.append((-1, 1))
+    elif line == 2: steps.append((-1, -1))
+    else:           steps.append((1, 1))
+    return steps
+
+def iterTurnStates():
+    for line in range(4):
+        for dx, dy in incomingSteps(line):
+            nextx, nexty = 1, line + 4
+            yield nextx - dx, nexty - dy, nextx, nexty
+
+def buildTurnTables():
+    targetTurns = [None] * (4 * 9 << 4)
+    racecarTurns = [None] * (4 * 9 << 1)
+
+    for x, y, nextx, nexty in iterTurnStates():
+        state = turnState(x, y, nextx, nexty)
+
+        for mask in range(16):
+            target = [bool(mask & (1 << i)) for i in range(4)]
+            targetTurns[state << 4 | mask] = referenceTurn(x, y, nextx, nexty, target, 1, False)
+
+        for nextdir in (-1, 1):
+            racecarTurns[state << 1 | (nextdir == 1)] = referenceTurn(x, y, nextx, nexty, None, nextdir, True)
+
+    return targetTurns, racecarTurns
+
+def verifyTurnTables():
+    # compares the tables against referenceTurn() for every reachable state
+    # and a few positions on each line. raises AssertionError on mismatch
+    for x, y, nextx, nexty in iterTurnStates():
+        for offsetx, offsety in ((0, 0), (-1, 0), (5, 8), (-3, -12)):
+            player = Player(x + offsetx, y + offsety)
+            player.nextx = nextx + offsetx
+            player.nexty = nexty + offsety
+
+            for mask in range(16):
+                player.target_right_left_down_up = [bool(mask & (1 << i)) for i in range(4)]
+                for racecar in (False, True):
+                    for nextdir in (-1, 1):
+                        player.racecar = racecar
+                        player.nextdir = nextdir
+
+                        expected = referenceTurn(player.x, player.y, player.nextx, player.nexty,
+                                                 player.target_right_left_down_up, nextdir, racecar)
+                        if racecar:
+                            result = RACECAR_TURNS[turnState(player.x, player.y, player.nextx, player.nexty) << 1 | (nextdir == 1)]
+                        else:
+                            result = TARGET_TURNS[turnState(player.x, player.y, player.nextx, player.nexty) << 4 | mask]
+
+                        assert result == expected, 'turn table mismatch at %s: %s != %s' % (
+                            (player.x, player.y, player.nextx, player.nexty, mask, nextdir, racecar), result, expected)
+
+
+TARGET_TURNS, RACECAR_TURNS = buildTurnTables()
+
+
+if __name__ == '__main__':
+    verifyTurnTables()
+    print('turn tables ok')
@@ -0,0 +1,164 @@
+import numpy as np
+import pygame
+
+import hexgrid
+import ledwall
+
+
+# -- retained grid rendering
+#
+# the grid is kept on its own surface. HexGrid.setSegmentColor() only marks
+# the touched segments dirty, and only those get redrawn. a full rebuild
+# happens when the brightness lut or the grid layout changes, after bulk
+# operations on the grid (or after invalidate())
+#
+# full rebuilds do not draw line by line. the pixels every segment covers
+# are rasterized once per geometry and surface size (a pixel belongs to the
+# last segment drawn over it, as in a line by line redraw), after that a
+# rebuild is a single scatter of the mapped segment colors through
+# surfarray. surfaces whose pixel format can not be written that way fall
+# back to drawing every line
+
+def buildCoverage(geometry, size, pitch):
+    # (pixel offsets in 32 bit words, segment index) of every covered
+    # pixel, in memory order
+    ids = pygame.Surface(size, 0, 32)
+    ids.fill(0)
+
+    c = geometry.segmentCoords
+    for index in range(geometry.grid.numSegments):
+        i = index * 4
+        pygame.draw.line(ids, index + 1, (c[i], c[i+1]), (c[i+2], c[i+3]))
+
+    pixels = pygame.surfarray.array2d(ids)
+    ys, xs = np.nonzero(pixels.T)
+
+    return (ys * (pitch // 4) + xs).astype(np.intp), (pixels[xs, ys] - 1).astype(np.intp)
+
+def mapColors(surface, colors, lut):
+    # rgb rows through the brightness lut as mapped pixel values of
+    # surface, None if the format needs a map_rgb() per color
+    if surface.get_bitsize() != 32 or surface.get_losses()[:3] != (0, 0, 0):
+        return None
+
+    lut = np.array(lut).astype(np.uint32)   # truncated like pygame.draw does
+    rshift, gshift, bshift, ashift = surface.get_shifts()
+    channels = np.ascontiguousarray(colors.T)
+
+    mapped = (lut << rshift)[channels[0]] | (lut << gshift)[channels[1]] | (lut << bshift)[channels[2]]
+    if surface.get_masks()[3]:
+        mapped |= np.uint32(surface.get_masks()[3])
+
+    return mapped
+
+
+class GridView:
+    def __init__(self, grid, hexWidth, hexHeight):
+        self.grid = grid
+        self.hexWidth = hexWidth
+        self.hexHeight = hexHeight
+
+        self.geometry = None
+
+        self.surface = None
+        self.surfaceState = None
+
+        self.coverage = None
+        self.coverageState = None
+
+    def getGeometry(self):
+        # (re)build the geometry table whenever the grid or hex dimensions change
+        grid = self.grid
+
+        if (self.geometry is None or self.geometry.grid is not grid
+            or self.geometry.layout != (grid.width, grid.height, self.hexWidth, self.hexHeight)):
+            self.geometry = hexgrid.GridGeometry(grid, self.hexWidth, self.hexHeight)
+
+        return self.geometry
+
+    def invalidate(self):
+        self.surface = None
+
+    def drawSegment(self, surface, geometry, index, color):
+        c = geometry.segmentCoords
+        i = index * 4
+
+        pygame.draw.line(surface, ledwall.brightness(color), (c[i], c[i+1]), (c[i+2], c[i+3]))
+
+    def updateSurface(self, output):
+        # brings the retained surface up to date, returns the indices of the
+        # redrawn segments or None after a full rebuild
+        grid = self.grid
+        geometry = self.getGeometry()
+        state = (ledwall.brightnessLut, geometry, output.get_size())
+
+        if self.surface is None or state != self.surfaceState or grid.allDirty:
+            if self.surface is None or self.surface.get_size() != output.get_size():
+                self.surface = pygame.Surface(output.get_size(), 0, output)
+
+            self.rebuild(geometry)
+
+            self.surfaceState = state
+            changed = None
+        else:
+            changed = list(grid.dirty)
+            for index in changed:
+                self.drawSegment(self.surface, geometry, index, grid.getColor(index))
+
+        grid.clearDirty()
+
+        return changed
+
+    def rebuild(self, geometry):
+        surface = self.surface
+        mapped = mapColors(surface, self.grid.colors, ledwall.brightnessLut)
+
+        if mapped is None:
+            surface.fill((0, 0, 0))
+            for index, color in enumerate(self.grid.colors.tolist()):
+                self.drawSegment(surface, geometry, index, color)
+            return
+
+        state = (geometry, surface.get_size(), surface.get_pitch())
+        if self.coverageState != state:
+            self.coverage = buildCoverage(geometry, surface.get_size(), surface.get_pitch())
+            self.coverageState = state
+
+        offsets, segments = self.coverage
+
+        pixels = np.frombuffer(surface.get_buffer(), dtype=np.uint32)
+        pixels.fill(surface.map_rgb((0, 0, 0)))
+        pixels[offsets] = mapped[segments]
+        del pixels      # releases the surface lock
+
+    def drawGrid(self, output):
+        self.updateSurface(output)
+        output.blit(self.surface, (0, 0))
+
+    def playerRects(self, players, alpha=0.):
+        # alpha is the part of a simulation tick that passed since the last
+        # update, players are drawn that far ahead on their current segment
+        geometry = self.getGeometry()
+        rects = []
+
+        for player in players:
+            oldx, oldy = geometry.screenCoords(player.x, player.y)
+            newx, newy = geometry.screenCoords(player.nextx, player.nexty)
+
+            dist = player.dist
+            if not player.idle and not player.crashed:
+                dist = min(dist + player.speed * alpha, 1.0)
+
+            x = oldx + (newx - oldx) * dist
+            y = oldy + (newy - oldy) * dist
+
+            rects.append(pygame.Rect(x-2, y-2, 5, 5))
+
+        return rects
+
+    def drawPlayers(self, output, players, alpha=0., rects=None):
+        if rects is None:
+            rects = self.playerRects(players, alpha)
+
+        for player, rect in zip(players, rects):
+            pygame.draw.ellipse(output, ledwall.brightness(player.color), rect=rect)
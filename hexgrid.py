@@ -0,0 +1,218 @@
+from array import array
+
+import numpy as np
+
+
+#x=0 : x=1   : x=2
+#    :       :
+#    : |     :
+#    :/ \    :/         y=0
+# \ /:    \ /:
+#  | :     | .          y=1
+#  | :     | .
+#  | :     |            y=2
+# / \:    / \
+#    :\ /               y=3
+#    : |
+#
+# nodes are addressed by (x, y). the grid of width w and height h has
+# nodes for x in -1..w and y in 0..h (the diagonals of line 0 reach
+# one column to the left)
+
+DEFAULT_COLOR = (64, 64, 64)
+NO_OWNER = -1
+
+
+def iterSegments(width, height):
+    for y in range(height):
+        for x in range(width):
+            yield x, y, x, y+1
+
+            if y % 4 == 0:
+                yield x, y, x-1, y+1
+            elif y % 4 == 2:
+                yield x, y, x+1, y+1
+
+def segmentTable(width, height):
+    # end points (x1, y1, x2, y2) of all segments as arrays, in the order of
+    # iterSegments(): every row has a vertical and a diagonal slot per x,
+    # the diagonal slots of rows without diagonals are dropped
+    slant = np.zeros(height, dtype=np.int32)
+    slant[0::4] = -1
+    slant[2::4] = 1
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.int32)
+    x2 = np.stack((x, x + slant[:, None]), axis=2)
+    keep = np.stack((np.ones_like(x, dtype=bool), np.broadcast_to(slant[:, None] != 0, x.shape)), axis=2)
+
+    x1 = np.stack((x, x), axis=2)
+    y1 = np.stack((y, y), axis=2)
+    return x1[keep], y1[keep], x2[keep], y1[keep] + 1
+
+def directionIndex(dx, dy):
+    # steps between neighbouring nodes are numbered 0..8 (only 6 of them exist)
+    return (dx + 1) * 3 + (dy + 1)
+
+def getScreenCoords(x, y, hexWidth, hexHeight):
+    if int(y) % 4 in (0, 3):
+        px = x * hexWidth
+        py = y * hexHeight / 3.
+    else:
+        px = (x + 0.5) * hexWidth
+        py = y * hexHeight / 3.
+
+    return px, py
+
+
+# -- grid data
+#
+# segments are numbered densely in the order iterSegments() yields them.
+# a segment is looked up by its first node and the direction of the step,
+# nodeSegments holds the index for all 9 directions of a node (-1: none).
+# segment colors live in one contiguous (numSegments, 3) uint8 buffer.
+# writes are collected in the dirty set, bulk operations set allDirty instead.
+#
+# the occupancy index holds the owner (player number) of every segment and
+# node written with an owner, NO_OWNER where free. a step is blocked when its
+# segment does not exist or its target node is taken
+
+class HexGrid:
+    def __init__(self, width, height, defaultColor=DEFAULT_COLOR):
+        self.width = width
+        self.height = height
+        self.defaultColor = tuple(defaultColor)
+
+        self.nodeStride = width + 2
+        self.numNodes = self.nodeStride * (height + 1)
+
+        x1, y1, x2, y2 = segmentTable(width, height)
+        self.numSegments = len(x1)
+        indices = np.arange(self.numSegments, dtype=np.int32)
+
+        self.segmentNodes = np.stack((y1 * self.nodeStride + x1 + 1, y2 * self.nodeStride + x2 + 1), axis=1)
+        self.nodeSegments = np.full((self.numNodes, 9), -1, dtype=np.int32)   # node, directionIndex -> segment index
+        self.nodeSegments[self.segmentNodes[:, 0], directionIndex(x2 - x1, y2 - y1)] = indices
+        self.nodeSegments[self.segmentNodes[:, 1], directionIndex(x1 - x2, y1 - y2)] = indices
+
+        self.colors = np.empty((self.numSegments, 3), dtype=np.uint8)
+        self.colors[:] = self.defaultColor
+
+        self.segmentOwner = np.full(self.numSegments, NO_OWNER, dtype=np.int16)
+        self.nodeOwner = np.full(self.numNodes, NO_OWNER, dtype=np.int16)
+
+        self.dirty = set()
+        self.allDirty = True
+
+    def nodeIndex(self, x, y):
+        if -1 <= x <= self.width and 0 <= y <= self.height:
+            return y * self.nodeStride + x + 1
+        return -1
+
+    def segmentIndex(self, pointFrom, pointTo):
+        node = self.nodeIndex(pointFrom[0], pointFrom[1])
+        dx = pointTo[0] - pointFrom[0]
+        dy = pointTo[1] - pointFrom[1]
+        if node < 0 or not (-1 <= dx <= 1 and -1 <= dy <= 1):
+            return -1
+        return int(self.nodeSegments[node, directionIndex(dx, dy)])
+
+    def incidentSegments(self, x, y):
+        node = self.nodeIndex(x, y)
+        if node < 0:
+            return []
+        return [index for index in self.nodeSegments[node].tolist() if index >= 0]
+
+    def getColor(self, index):
+        return tuple(self.colors[index].tolist())
+
+    def setColor(self, index, color):
+        self.colors[index] = color
+        self.dirty.add(index)
+
+    def setSegmentColor(self, pointFrom, pointTo, color, owner=None):
+        index = self.segmentIndex(pointFrom, pointTo)
+        if index >= 0:      # writes off the grid are ignored
+            self.colors[index] = color
+            self.dirty.add(index)
+
+            if owner is not None:
+                node1, node2 = self.segmentNodes[index]
+                self.segmentOwner[index] = owner
+                self.nodeOwner[node1] = owner
+                self.nodeOwner[node2] = owner
+        return index
+
+    # -- occupancy
+
+    def isBlocked(self, pointFrom, pointTo):
+        if self.segmentIndex(pointFrom, pointTo) < 0:
+            return True
+        return self.nodeOwner[self.nodeIndex(pointTo[0], pointTo[1])] != NO_OWNER
+
+    def clearOwners(self):
+        self.segmentOwner.fill(NO_OWNER)
+        self.nodeOwner.fill(NO_OWNER)
+
+    # -- bulk operations
+
+    def reset(self):
+        self.fill(self.defaultColor)
+        self.clearOwners()
+
+    def fill(self, color, indices=None):
+        if indices is None:
+            self.colors[:] = color
+            self.allDirty = True
+        else:
+            indices = np.asarray(indices, dtype=np.intp)
+            self.colors[indices] = color
+            self.dirty.update(indices.tolist())
+
+    def recolor(self, fromColor, toColor):
+        indices = np.flatnonzero((self.colors == fromColor).all(axis=1))
+        self.colors[indices] = toColor
+        self.dirty.update(indices.tolist())
+        return len(indices)
+
+    def clearDirty(self):
+        self.dirty.clear()
+        self.allDirty = False
+
+
+# -- precomputed geometry
+#
+# node pixel positions and segment end points of a HexGrid are computed once
+# and stored in flat arrays, indexed by node and segment index
+
+class GridGeometry:
+    def __init__(self, grid, hexWidth, hexHeight):
+        self.grid = grid
+        self.hexWidth = hexWidth
+        self.hexHeight = hexHeight
+
+        self.layout = (grid.width, grid.height, hexWidth, hexHeight)
+
+        # getScreenCoords() for all nodes, in node index order
+        y, x = np.mgrid[0:grid.height + 1, -1:grid.width + 1]
+        shifted = (y % 4 == 1) | (y % 4 == 2)
+        nodeX = (x + np.where(shifted, 0.5, 0.)) * hexWidth
+        nodeY = y * hexHeight / 3.
+
+        self.nodeX = array('d', nodeX.ravel().tobytes())
+        self.nodeY = array('d', nodeY.ravel().tobytes())
+
+        nodes = grid.segmentNodes
+        coords = np.stack((nodeX.flat[nodes[:, 0]], nodeY.flat[nodes[:, 0]],
+                           nodeX.flat[nodes[:, 1]], nodeY.flat[nodes[:, 1]]), axis=1)
+        self.segmentCoords = array('d', coords.tobytes())
+
+    def screenCoords(self, x, y):
+        i = self.grid.nodeIndex(x, y)
+        if i < 0:   # off the grid, e.g. a player that left the screen
+            return getScreenCoords(x, y, self.hexWidth, self.hexHeight)
+        return self.nodeX[i], self.nodeY[i]
+
+    def segmentLine(self, index):
+        c = self.segmentCoords
+        i = index * 4
+        return (c[i], c[i+1]), (c[i+2], c[i+3])
@@ -1,4 +1,8 @@
+from collections import deque
+
 import pygame
+
+import ddp
 from bitmapfont import BitmapFont
 
 SCR_W = 256
@@ -8,40 +12,75 @@ window = None   # the actual ui window
 output = None   # the render target
 scaled = None   # scale surface to distort output
 overlay = None  # vertical masking stripes
+dimmer = None   # black surface blended over the frame in 'frame' brightness mode
+networkOutput = None    # ddp.DdpSender, see initNetworkOutput()
+canvas = None   # the whole screen in 'tiled' mode, output is its first wall
+tiledOutput = None      # tiles.TiledView presenting the canvas, see setTiledOutput()
+frameCapture = None     # capture.FrameCapture getting every composed frame, see setFrameCapture()
 
 brightnessValue = -4
+brightnessMode = 'primitive'    # 'primitive' = dim every color drawn, 'frame' = dim the finished frame in compose()
+brightnessLut = None            # maps channel values 0..255 to their dimmed value, see setBrightnessValue()
+frameBrightnessLevel = 255      # 0..255 intensity of the frame pass
 showOverlay = True
 
 renderMode = 'led'
+composeMode = 'classic'     # led mode only: 'classic' = scale + overlay blit + flip, 'fast' = see _presentFast()
+
+DIRTY_BAND_HEIGHT = 16      # rows per dirty rect in fast compose mode
+
+_previousFrame = None       # pixels of the last frame presented in fast compose mode
+_fullUpdate = True
 
-pygame.display.init()
+textDrawn = False           # text or console went onto output since the last compose
+
+# nothing is initialized at import. the display comes up in initScreen(),
+# fonts are loaded by getFont() on first use or by prewarm()
 
 fonts = {}
 fontFilename = 'gfx/heimatfont.png'
 fontCharsize = (8, 8)
 lastFontColor = (255, 255, 255)
 
-printMessages = []
+# -- console
+#
+# printed lines go into a ring buffer of one screen of lines. they are
+# rendered onto their own surface only when print() or cls() changed them
+# (or the brightness did), compose() then blits that surface once
+
+CONSOLE_COLOR = (192, 192, 192)
+
+printMessages = deque(maxlen=SCR_H // fontCharsize[1])
+console = None          # rendered console lines, black is transparent
+consoleState = None
+consoleDirty = True
 
 _originalPrintFunction = print
 
 def initFont(filename, char_w=8, char_h=8, zoom=1):
     fonts[zoom] = BitmapFont(filename, scr_w=SCR_W, scr_h=SCR_H, char_w=char_w, char_h=char_h, zoom=zoom)
 
-for i in range(1, 3):
-    initFont(fontFilename, fontCharsize[0], fontCharsize[1], zoom=i)
+def getFont(zoom=1):
+    if not zoom in fonts:
+        initFont(fontFilename, fontCharsize[0], fontCharsize[1], zoom)
+    return fonts[zoom]
 
 
 # -- screen handling and composing
 
-def initScreen(mode='led'):
-    global window, output, scaled, overlay, renderMode
+def initScreen(mode='led', panels=(1, 1)):
+    global window, output, scaled, overlay, dimmer, renderMode, canvas
 
     renderMode = mode
 
+    if not pygame.display.get_init():
+        pygame.display.init()
+
+    setComposeMode(composeMode)
+
     if renderMode == 'led':
         window = pygame.display.set_mode((1920, 1080), flags=pygame.FULLSCREEN)
-        output = pygame.Surface((SCR_W, SCR_H))
+        output = pygame.Surface((SCR_W, SCR_H), 0, window)
         scaled = pygame.Surface((SCR_W * 2, SCR_H))
         overlay = pygame.Surface((SCR_W * 2, SCR_H), flags=pygame.SRCALPHA)
 
@@ -52,16 +91,72 @@ def initScreen(mode='led'):
         window = pygame.display.set_mode((SCR_W, SCR_H), flags=pygame.SCALED)
         output = window
 
+    elif renderMode == 'ddp':   # frames go out over the network, the window is a preview
+        window = pygame.display.set_mode((SCR_W, SCR_H), flags=pygame.SCALED)
+        output = pygame.Surface((SCR_W, SCR_H), 0, window)
+
+    elif renderMode == 'tiled':     # panels = (columns, rows) of walls, the window shows all of them
+        window = pygame.display.set_mode((SCR_W * panels[0], SCR_H * panels[1]), flags=pygame.SCALED)
+        canvas = window
+        output = window.subsurface((0, 0, SCR_W, SCR_H))
+
+    # blending black with per-surface alpha is much cheaper than a BLEND_MULT
+    # fill or a surfarray lut pass
+    dimmer = pygame.Surface((SCR_W, SCR_H))
+    dimmer.set_alpha(255 - frameBrightnessLevel)
+
     return output
 
-def compose(do_cls=False):
+def prewarm(texts=()):
+    # builds what the first frames would otherwise build on the fly: the
+    # fonts, the text masks of texts (pairs of text and fontsize) and the
+    # console surface. call after initScreen()
+    scratch = pygame.Surface((SCR_W, SCR_H), 0, output)
+
+    for text, fontsize in texts:
+        getFont(fontsize).drawText(scratch, text, x=0, y=0, fgcolor=(255, 255, 255))
+
+    _renderConsole()
+
+def compose(do_cls=False, profiler=None):
     _drawPrintLog()
     if do_cls:
         cls()
 
+    if profiler is not None:
+        profiler.mark('printlog')
+
+    _present()
+
+def _present():
+    global textDrawn
+
+    if renderMode == 'tiled':
+        tiledOutput.present()
+        textDrawn = False
+        if frameCapture is not None:
+            frameCapture.submit(canvas)
+        return
+
+    if frameBrightnessLevel < 255:
+        output.blit(dimmer, (0, 0))
+
+    if networkOutput is not None:
+        networkOutput.submit(output)
+
+    if frameCapture is not None:
+        frameCapture.submit(output)
+
     if renderMode == 'plain':
         pass
 
+    elif renderMode == 'ddp':
+        window.blit(output, (0, 0))
+
+    elif renderMode == 'led' and composeMode == 'fast':
+        _presentFast()
+        return
+
     elif renderMode == 'led':
         pygame.transform.scale(output, (SCR_W * 2, SCR_H), scaled)
         window.blit(scaled, (0, 0))
@@ -70,39 +165,131 @@ def compose(do_cls=False):
 
     pygame.display.flip()
 
+def _presentFast():
+    # the output is copied straight into every second column of the window,
+    # the other columns stay black and form the stripes. only the row bands
+    # that changed since the last frame are copied and handed to
+    # display.update()
+    global _previousFrame, _fullUpdate
+
+    current = pygame.surfarray.pixels2d(output).T     # (SCR_H, SCR_W), rows are contiguous
+
+    if _fullUpdate or _previousFrame is None:
+        window.fill((0, 0, 0), (0, 0, SCR_W * 2, SCR_H))
+        rects = [pygame.Rect(0, 0, SCR_W, SCR_H)]
+        _previousFrame = current.copy()
+        _fullUpdate = False
+    else:
+        rects = _dirtyRects(current != _previousFrame)
+
+    target = pygame.surfarray.pixels2d(window).T
+
+    for r in rects:
+        pixels = current[r.top:r.bottom, r.left:r.right]
+        _previousFrame[r.top:r.bottom, r.left:r.right] = pixels
+
+        target[r.top:r.bottom, r.left * 2 + 1:r.right * 2:2] = pixels
+        if not showOverlay:
+            target[r.top:r.bottom, r.left * 2:r.right * 2:2] = pixels
+
+    del current, target     # release the surface locks
+
+    if rects:
+        pygame.display.update([(r.left * 2, r.top, r.width * 2, r.height) for r in rects])
+
+def _dirtyRects(changed):
+    # changed is a (SCR_H, SCR_W) bool array, returns one rect per band of
+    # DIRTY_BAND_HEIGHT rows that spans the changed columns of that band
+    bands = changed.reshape(-1, DIRTY_BAND_HEIGHT, SCR_W).any(axis=1)
+
+    rects = []
+    for band in bands.any(axis=1).nonzero()[0].tolist():
+        columns = bands[band]
+        left = int(columns.argmax())
+        right = SCR_W - int(columns[::-1].argmax())
+        rects.append(pygame.Rect(left, band * DIRTY_BAND_HEIGHT, right - left, DIRTY_BAND_HEIGHT))
+
+    return rects
+
+def initNetworkOutput(host, port=ddp.DDP_PORT, delta=True):
+    global networkOutput
+    closeNetworkOutput()
+    networkOutput = ddp.DdpSender(host, port, SCR_W, SCR_H, delta=delta)
+
+def setTiledOutput(view):
+    global tiledOutput
+    tiledOutput = view
+
+def setFrameCapture(capture):
+    global frameCapture
+    frameCapture = capture
+
+def closeNetworkOutput():
+    global networkOutput
+    if networkOutput is not None:
+        networkOutput.stop()
+        networkOutput = None
+
+def setComposeMode(mode):
+    global composeMode, _fullUpdate
+    composeMode = mode
+    _fullUpdate = True
+
 def enableOverlay(flag=True):
-    global showOverlay
+    global showOverlay, _fullUpdate
     showOverlay = flag
+    _fullUpdate = True
 
 def setBrightnessValue(b):
-    global brightnessValue
+    global brightnessValue, brightnessLut, frameBrightnessLevel
     brightnessValue = b
 
+    # in frame mode colors are drawn at full intensity and the whole frame
+    # is multiplied once in compose(). this can only dim, values above 0
+    # act like 0 there
+    if brightnessMode == 'frame':
+        brightnessLut = getBrightnessLut(0)
+        frameBrightnessLevel = min(round(255 * 2**(b / 4)), 255)
+    else:
+        brightnessLut = getBrightnessLut(b)
+        frameBrightnessLevel = 255
+
+    if dimmer is not None:
+        dimmer.set_alpha(255 - frameBrightnessLevel)
+
+def setBrightnessMode(mode):
+    global brightnessMode
+    brightnessMode = mode
+    setBrightnessValue(brightnessValue)
+
 
 # -- color conversion
 
-def gamma(v):
-    return min(v * 2**(brightnessValue / 4), 255)
+_brightnessLuts = {}
+
+def getBrightnessLut(b):
+    if b not in _brightnessLuts:
+        factor = 2**(b / 4)
+        _brightnessLuts[b] = tuple([min(v * factor, 255) for v in range(256)])
+    return _brightnessLuts[b]
 
 def brightness(color):
-    color = list(color)
+    lut = brightnessLut
     if isinstance(color[0], (list, tuple)):
-        result = []
-        for co in color:
-            result.append(tuple([gamma(c) for c in co]))
-        return result
-    return tuple([gamma(c) for c in color])
+        return [tuple([lut[c] for c in co]) for co in color]
+    return tuple([lut[c] for c in color])
+
+setBrightnessValue(brightnessValue)
 
 
 # -- text drawing using the bitmapfont
 
 def drawText(text, x=None, y=None, color=None, fontsize=1, center=False):
-    global lastFontColor
+    global lastFontColor, textDrawn
 
-    if not fontsize in fonts:
-        initFont(fontFilename, fontCharsize[0], fontCharsize[1], fontsize)
+    textDrawn = True
 
-    font = fonts[fontsize]
+    font = getFont(fontsize)
 
     if color is None:
         color = lastFontColor
@@ -119,10 +306,15 @@ def centerText(text, y=None, color=None, fontsize=1):
     drawText(text, y=y, color=color, fontsize=fontsize, center=True)
 
 def print(*args):
-    text = ' '.join([str(arg) for arg in args])
+    writeConsole(' '.join([str(arg) for arg in args]))
+    _originalPrintFunction(*args)
+
+def writeConsole(text):
+    global consoleDirty
+
     lines = text.split('\n')
 
-    charsPerLine = SCR_W // fonts[1].char_w
+    charsPerLine = SCR_W // getFont(1).char_w
 
     for line in lines:
         if not line:
@@ -132,22 +324,42 @@ def print(*args):
             printMessages.append(line[:charsPerLine])
             line = line[charsPerLine:]
 
-    _originalPrintFunction(*args)
+    consoleDirty = True
 
 def cls():
-    printMessages.clear()
+    global consoleDirty
+
+    if printMessages:
+        printMessages.clear()
+        consoleDirty = True
 
 def _drawPrintLog():
-    global lastFontColor
+    global textDrawn
+
+    if not printMessages:
+        return
+
+    textDrawn = True
+
+    _renderConsole()
+    output.blit(console, (0, 0), (0, 0, SCR_W, len(printMessages) * getFont(1).char_h))
+
+def _renderConsole():
+    global console, consoleState, consoleDirty
 
-    font = fonts[1]
-    maxlines = SCR_H // font.char_h
+    font = getFont(1)
+    state = (brightnessLut, output)
 
-    font.locate(0, 0)
+    if consoleDirty or state != consoleState:
+        if consoleState is None or consoleState[1] is not output:
+            console = pygame.Surface((SCR_W, SCR_H), 0, output)
+            console.set_colorkey((0, 0, 0))
 
-    colorBackup = lastFontColor
+        console.fill((0, 0, 0))
+        color = brightness(CONSOLE_COLOR)
 
-    for line in printMessages[-maxlines:]:
-        drawText(line.upper(), color=(192, 192, 192))
+        for y, line in enumerate(printMessages):
+            font.drawText(console, line.upper(), x=0, y=y, fgcolor=color)
 
-    lastFontColor = colorBackup
+        consoleState = state
+        consoleDirty = False
@@ -0,0 +1,625 @@
+import argparse
+import heapq
+import random
+import socket
+import struct
+import time
+from collections import deque
+
+import numpy as np
+
+import game
+import hexgrid
+
+
+# -- networked play
+#
+# the host runs the simulation and sends the grid to its clients over udp,
+# clients show it and send their players' input back.
+#
+# every packet starts with PACKET (magic, message type, tick). after each
+# simulation tick the host sends a DELTA: the positions of all players and
+# the current color of every segment that changed in the last REDUNDANCY + 1
+# ticks, found by comparing the grid colors with the previous tick. colors
+# are absolute, so applying a change twice does no harm, and a client
+# applies a delta whenever its last tick is at or after the delta's base
+# tick: up to REDUNDANCY lost packets in a row cost nothing. a client that
+# missed more waits for the next KEYFRAME, which the host sends every
+# KEYFRAME_INTERVAL ticks, when a client asks for it, or instead of a delta
+# too large for one packet (a new round). keyframes hold every segment that
+# is not the default color, split into as many packets as needed.
+#
+# clients send the held direction keys of each of their players as a bit
+# mask (INPUT), whenever a key changes and repeated every INPUT_INTERVAL, so
+# a lost packet does not leave a key stuck. the host turns mask changes into
+# press and release events. a HELLO every HELLO_INTERVAL keeps a client on
+# the host's list. while a client has no state or is stuck behind a gap,
+# it says hello every KEYFRAME_REQUEST_INTERVAL and asks for a keyframe.
+#
+# the host listens on every interface, so packets are checked before they
+# are read: a packet shorter than its header and the players and changes it
+# announces, or with segments or players out of range, is counted in
+# packetsRejected and dropped
+
+NET_PORT = 4049
+
+MSG_DELTA = 1
+MSG_KEYFRAME = 2
+MSG_INPUT = 3
+MSG_HELLO = 4
+
+MAGIC = b'HX'
+PACKET = struct.Struct('<2sBI')                 # magic, message type, tick
+DELTA = struct.Struct('<IBH')                   # base tick, players, changes
+KEYFRAME = struct.Struct('<HH3sHHBH')           # grid width, height, default color, chunk, chunks, players, changes
+PLAYER = struct.Struct('<hhhhfB')               # x, y, nextx, nexty, dist, flags
+INPUT = struct.Struct('<IB')                    # sequence, players, followed by (player, mask) byte pairs
+HELLO = struct.Struct('<B')                     # flags
+
+PLAYER_CRASHED = 0x01
+PLAYER_IDLE = 0x02
+HELLO_NEEDS_KEYFRAME = 0x01
+
+MAX_PAYLOAD = 1400
+REDUNDANCY = 2
+KEYFRAME_INTERVAL = 120     # ticks
+INPUT_INTERVAL = 0.05       # seconds
+HELLO_INTERVAL = 1.0        # seconds
+KEYFRAME_REQUEST_INTERVAL = 0.25    # seconds
+CLIENT_TIMEOUT = 5.0        # seconds without a packet until a client is dropped
+
+
+def changeType(grid):
+    # segment index and color, 5 bytes per change on grids with less than 64k segments
+    return np.dtype([('index', '<u2' if grid.numSegments <= 0xffff else '<u4'), ('color', 'u1', 3)])
+
+def packPlayers(players):
+    return b''.join(PLAYER.pack(p.x, p.y, p.nextx, p.nexty, p.dist,
+                                (PLAYER_CRASHED if p.crashed else 0) | (PLAYER_IDLE if p.idle else 0))
+                    for p in players)
+
+def unpackPlayers(data, offset, count, players):
+    for i in range(count):
+        x, y, nextx, nexty, dist, flags = PLAYER.unpack_from(data, offset)
+        offset += PLAYER.size
+
+        if i < len(players):
+            p = players[i]
+            p.x, p.y, p.nextx, p.nexty, p.dist = x, y, nextx, nexty, dist
+            p.crashed = bool(flags & PLAYER_CRASHED)
+            p.idle = bool(flags & PLAYER_IDLE)
+
+    return offset
+
+
+class NetHost:
+    def __init__(self, grid, players, port=NET_PORT, host='0.0.0.0',
+                 keyframeInterval=KEYFRAME_INTERVAL, redundancy=REDUNDANCY):
+        self.grid = grid
+        self.players = players
+        self.keyframeInterval = keyframeInterval
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind((host, port))
+        self.socket.setblocking(False)
+
+        self.changeType = changeType(grid)
+        self.maxChanges = (MAX_PAYLOAD - PACKET.size - KEYFRAME.size - PLAYER.size * len(players)) // self.changeType.itemsize
+
+        self.colors = grid.colors.copy()        # as of the last tick
+        self.history = deque(maxlen=redundancy + 1)     # (tick, changed segment indices)
+        self.lastKeyframe = None
+        self.keyframeRequested = False
+
+        self.clients = {}       # address -> [time of the last packet, last input sequence]
+        self.inputMasks = {}    # player -> held direction bits
+
+        self.packetsSent = 0
+        self.bytesSent = 0
+        self.keyframesSent = 0
+        self.packetsReceived = 0
+        self.bytesReceived = 0
+        self.packetsRejected = 0
+
+    # -- input from clients
+
+    def update(self, now=None):
+        # returns the (player, direction, pressed) events of the received input
+        now = time.monotonic() if now is None else now
+        events = []
+
+        while True:
+            try:
+                data, address = self.socket.recvfrom(2048)
+            except (BlockingIOError, ConnectionResetError):
+                break
+
+            try:
+                magic, messageType, tick = PACKET.unpack_from(data)
+            except struct.error:
+                continue
+            if magic != MAGIC:
+                continue
+            if not self._valid(messageType, data):
+                self.packetsRejected += 1
+                continue
+
+            self.packetsReceived += 1
+            self.bytesReceived += len(data)
+
+            client = self.clients.get(address)
+            if client is None:
+                client = self.clients[address] = [now, -1]
+                self.keyframeRequested = True
+            client[0] = now
+
+            if messageType == MSG_HELLO:
+                flags, = HELLO.unpack_from(data, PACKET.size)
+                if flags & HELLO_NEEDS_KEYFRAME:
+                    self.keyframeRequested = True
+
+            elif messageType == MSG_INPUT:
+                sequence, count = INPUT.unpack_from(data, PACKET.size)
+                if sequence <= client[1]:   # late or duplicate
+                    continue
+                client[1] = sequence
+
+                offset = PACKET.size + INPUT.size
+                for player, mask in zip(data[offset:offset + count * 2:2], data[offset + 1:offset + count * 2:2]):
+                    if player >= len(self.players):
+                        continue
+                    old = self.inputMasks.get(player, 0)
+                    for d in range(4):
+                        if (mask ^ old) & 1 << d:
+                            events.append((player, d, bool(mask & 1 << d)))
+                    self.inputMasks[player] = mask
+
+        for address, client in list(self.clients.items()):
+            if now - client[0] > CLIENT_TIMEOUT:
+                del self.clients[address]
+
+        return events
+
+    def _valid(self, messageType, data):
+        if messageType == MSG_HELLO:
+            return len(data) >= PACKET.size + HELLO.size
+        if messageType == MSG_INPUT:
+            if len(data) < PACKET.size + INPUT.size:
+                return False
+            sequence, count = INPUT.unpack_from(data, PACKET.size)
+            return len(data) >= PACKET.size + INPUT.size + count * 2
+        return False
+
+    # -- state to clients
+
+    def sendTick(self, tick):
+        # call after every simulation tick
+        changed = np.flatnonzero((self.grid.colors != self.colors).any(axis=1))
+        self.colors[changed] = self.grid.colors[changed]
+        self.history.append((tick, changed))
+
+        if not self.clients:
+            return
+
+        indices = np.unique(np.concatenate([c for t, c in self.history]))
+
+        if (self.keyframeRequested or self.lastKeyframe is None
+                or tick - self.lastKeyframe >= self.keyframeInterval or len(indices) > self.maxChanges):
+            self.sendKeyframe(tick)
+            return
+
+        base = self.history[0][0] - 1
+        self._send(PACKET.pack(MAGIC, MSG_DELTA, tick)
+                   + DELTA.pack(base, len(self.players), len(indices))
+                   + packPlayers(self.players)
+                   + self._changes(indices))
+
+    def sendKeyframe(self, tick):
+        grid = self.grid
+        indices = np.flatnonzero((self.colors != grid.defaultColor).any(axis=1))
+        chunks = max(1, -(-len(indices) // self.maxChanges))
+        players = packPlayers(self.players)
+
+        for chunk in range(chunks):
+            part = indices[chunk * self.maxChanges:(chunk + 1) * self.maxChanges]
+            self._send(PACKET.pack(MAGIC, MSG_KEYFRAME, tick)
+                       + KEYFRAME.pack(grid.width, grid.height, bytes(grid.defaultColor), chunk, chunks,
+                                       len(self.players), len(part))
+                       + players
+                       + self._changes(part))
+
+        self.lastKeyframe = tick
+        self.keyframeRequested = False
+        self.keyframesSent += 1
+
+    def _changes(self, indices):
+        changes = np.empty(len(indices), dtype=self.changeType)
+        changes['index'] = indices
+        changes['color'] = self.colors[indices]
+        return changes.tobytes()
+
+    def _send(self, packet):
+        for address in self.clients:
+            try:
+                self.socket.sendto(packet, address)
+            except OSError:
+                continue
+            self.packetsSent += 1
+            self.bytesSent += len(packet)
+
+    def close(self):
+        self.socket.close()
+
+
+class NetClient:
+    def __init__(self, grid, players, host, port=NET_PORT):
+        self.grid = grid
+        self.players = players
+        self.address = (host, port)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.bind(('0.0.0.0', 0))
+        self.socket.setblocking(False)
+
+        self.changeType = changeType(grid)
+
+        self.tick = None            # last tick applied, None until the first keyframe
+        self.pending = {}           # tick -> (base tick, delta packet) not applicable yet
+        self.keyframe = None        # (tick, {chunk: packet}) being collected
+
+        self.inputMasks = {}        # local player -> held direction bits
+        self.inputSequence = 0
+        self.lastInput = 0.
+        self.lastHello = None
+
+        self.deltasApplied = 0
+        self.keyframesApplied = 0
+        self.gaps = 0               # deltas that could not be applied right away
+        self.packetsReceived = 0
+        self.bytesReceived = 0
+        self.bytesSent = 0
+        self.packetsRejected = 0
+        self.error = None           # set once when the host's grid does not fit ours
+        self.gridMismatch = False
+
+    # -- input to the host
+
+    def pressDirection(self, p, d):
+        self.inputMasks[p] = self.inputMasks.get(p, 0) | 1 << d
+        self.sendInput()
+
+    def releaseDirection(self, p, d):
+        self.inputMasks[p] = self.inputMasks.get(p, 0) & ~(1 << d)
+        self.sendInput()
+
+    def sendInput(self, now=None):
+        self.lastInput = time.monotonic() if now is None else now
+        self.inputSequence += 1
+
+        pairs = bytes(v for p, mask in sorted(self.inputMasks.items()) for v in (p, mask))
+        self._send(PACKET.pack(MAGIC, MSG_INPUT, self.tick or 0)
+                   + INPUT.pack(self.inputSequence, len(self.inputMasks)) + pairs)
+
+    # -- state from the host
+
+    def update(self, now=None):
+        # returns True when new state was applied
+        now = time.monotonic() if now is None else now
+        applied = False
+
+        while True:
+            try:
+                data = self.socket.recv(2048)
+            except (BlockingIOError, ConnectionResetError):
+                break
+
+            try:
+                magic, messageType, tick = PACKET.unpack_from(data)
+            except struct.error:
+                continue
+            if magic != MAGIC:
+                continue
+            if not self._valid(messageType, data):
+                self.packetsRejected += 1
+                continue
+
+            self.packetsReceived += 1
+            self.bytesReceived += len(data)
+
+            if messageType == MSG_DELTA:
+                applied |= self._receiveDelta(tick, data)
+            elif messageType == MSG_KEYFRAME:
+                applied |= self._receiveKeyframe(tick, data)
+
+        if self.inputMasks and now - self.lastInput >= INPUT_INTERVAL:
+            self.sendInput(now)
+
+        needsKeyframe = self.tick is None or bool(self.pending)
+        interval = KEYFRAME_REQUEST_INTERVAL if needsKeyframe else HELLO_INTERVAL
+
+        if self.lastHello is None or now - self.lastHello >= interval:
+            self.lastHello = now
+            flags = HELLO_NEEDS_KEYFRAME if needsKeyframe else 0
+            self._send(PACKET.pack(MAGIC, MSG_HELLO, self.tick or 0) + HELLO.pack(flags))
+
+        return applied
+
+    def _valid(self, messageType, data):
+        if messageType == MSG_DELTA:
+            header = DELTA
+        elif messageType == MSG_KEYFRAME:
+            header = KEYFRAME
+        else:
+            return False
+
+        offset = PACKET.size + header.size
+        if len(data) < offset:
+            return False
+        fields = header.unpack_from(data, PACKET.size)
+        numPlayers, numChanges = fields[-2:]
+
+        offset += numPlayers * PLAYER.size
+        if len(data) < offset + numChanges * self.changeType.itemsize:
+            return False
+        changes = np.frombuffer(data, dtype=self.changeType, count=numChanges, offset=offset)
+        if numChanges and changes['index'].max() >= self.grid.numSegments:
+            return False
+
+        if messageType == MSG_KEYFRAME:
+            width, height, defaultColor, chunk, chunks = fields[:5]
+            if chunk >= chunks:
+                return False
+            if (width, height) != (self.grid.width, self.grid.height):
+                if not self.gridMismatch:
+                    self.gridMismatch = True
+                    self.error = 'host grid is %dx%d, local grid is %dx%d' % (width, height, self.grid.width, self.grid.height)
+                return False
+
+        return True
+
+    def _receiveDelta(self, tick, data):
+        base, = struct.unpack_from('<I', data, PACKET.size)
+
+        if self.tick is not None and tick <= self.tick:
+            return False    # late or duplicate
+
+        if self.tick is None or base > self.tick:
+            self.gaps += 1
+            self.pending[tick] = (base, data)
+            if len(self.pending) > KEYFRAME_INTERVAL:
+                self.pending.pop(min(self.pending))
+            return False
+
+        self._applyDelta(tick, data)
+        self._applyPending()
+        return True
+
+    def _applyDelta(self, tick, data):
+        base, numPlayers, numChanges = DELTA.unpack_from(data, PACKET.size)
+        offset = unpackPlayers(data, PACKET.size + DELTA.size, numPlayers, self.players)
+        self._applyChanges(data, offset, numChanges)
+
+        self.tick = tick
+        self.deltasApplied += 1
+
+    def _applyPending(self):
+        for tick in sorted(self.pending):
+            base, data = self.pending[tick]
+            if tick <= self.tick:
+                del self.pending[tick]
+            elif base <= self.tick:
+                del self.pending[tick]
+                self._applyDelta(tick, data)
+
+    def _receiveKeyframe(self, tick, data):
+        width, height, defaultColor, chunk, chunks, numPlayers, numChanges = KEYFRAME.unpack_from(data, PACKET.size)
+
+        if self.tick is not None and tick <= self.tick:
+            return False
+
+        if self.keyframe is None or self.keyframe[0] != tick:
+            if self.keyframe is not None and self.keyframe[0] > tick:
+                return False    # an older keyframe, already replaced
+            self.keyframe = (tick, {})
+
+        parts = self.keyframe[1]
+        parts[chunk] = data
+        if len(parts) < chunks:
+            return False
+
+        self.grid.fill(tuple(defaultColor))
+        for data in parts.values():
+            width, height, defaultColor, chunk, chunks, numPlayers, numChanges = KEYFRAME.unpack_from(data, PACKET.size)
+            offset = unpackPlayers(data, PACKET.size + KEYFRAME.size, numPlayers, self.players)
+            self._applyChanges(data, offset, numChanges)
+
+        self.tick = tick
+        self.keyframe = None
+        self.keyframesApplied += 1
+        self._applyPending()
+        return True
+
+    def _applyChanges(self, data, offset, count):
+        changes = np.frombuffer(data, dtype=self.changeType, count=count, offset=offset)
+        for index, color in zip(changes['index'].tolist(), changes['color'].tolist()):
+            self.grid.setColor(index, color)
+
+    def _send(self, packet):
+        try:
+            self.socket.sendto(packet, self.address)
+        except OSError:
+            return
+        self.bytesSent += len(packet)
+
+    def close(self):
+        self.socket.close()
+
+
+# -- loopback test harness
+#
+# host, client and a lossy link between them run in one process on a
+# simulated clock of one tick per step. the link delays every packet by
+# latency (plus up to jitter) and drops a share of them in both directions.
+# the client presses random keys for player 0, the host steers player 1
+# itself. every state the client applies is checked against the host's
+# state at that tick
+
+class LossyLink:
+    def __init__(self, hostAddress, latency, jitter, loss, rng):
+        self.hostAddress = hostAddress
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.rng = rng
+
+        self.front = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)     # faces the client
+        self.front.bind(('127.0.0.1', 0))
+        self.front.setblocking(False)
+        self.back = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)      # faces the host
+        self.back.bind(('127.0.0.1', 0))
+        self.back.setblocking(False)
+
+        self.clientAddress = None
+        self.queue = []     # (delivery time, sequence, socket, packet, address)
+        self.sequence = 0
+        self.dropped = 0
+
+    def address(self):
+        return self.front.getsockname()
+
+    def pump(self, now):
+        for sock in (self.front, self.back):
+            while True:
+                try:
+                    data, address = sock.recvfrom(2048)
+                except BlockingIOError:
+                    break
+
+                if sock is self.front:
+                    self.clientAddress = address
+                    out, target = self.back, self.hostAddress
+                else:
+                    out, target = self.front, self.clientAddress
+
+                if self.rng.random() < self.loss:
+                    self.dropped += 1
+                    continue
+
+                delay = self.latency + self.rng.random() * self.jitter
+                heapq.heappush(self.queue, (now + delay, self.sequence, out, data, target))
+                self.sequence += 1
+
+        while self.queue and self.queue[0][0] <= now:
+            deliveryTime, sequence, out, data, target = heapq.heappop(self.queue)
+            out.sendto(data, target)
+
+    def close(self):
+        self.front.close()
+        self.back.close()
+
+
+def runLoopback(ticks, latency, jitter, loss, width=11, height=40, port=NET_PORT + 100, seed=1):
+    rng = random.Random(seed)
+    dt = 1.0 / 60
+
+    grid = hexgrid.HexGrid(width, height)
+    spawns = game.spawnPoints(width, height)[:2]
+    players = [game.Player(x, y, grid=grid, number=i) for i, (x, y) in enumerate(spawns)]
+    host = NetHost(grid, players, port, host='127.0.0.1')
+
+    link = LossyLink(('127.0.0.1', port), latency, jitter, loss, rng)
+
+    clientGrid = hexgrid.HexGrid(width, height)
+    clientPlayers = [game.Player(x, y) for x, y in spawns]
+    client = NetClient(clientGrid, clientPlayers, *link.address())
+
+    history = {}        # tick -> host state, to check the client against
+    roundEndTick = None
+    mismatches = 0
+    checked = 0
+    bytesPerTick = []
+
+    for step in range(ticks):
+        now = step * dt
+
+        for p, d, pressed in host.update(now):
+            if p < len(players):
+                (players[p].pressDirection if pressed else players[p].releaseDirection)(d)
+
+        if rng.random() < 0.05:
+            players[1].pressDirection(rng.randrange(4))
+        if rng.random() < 0.05:
+            players[1].releaseDirection(rng.randrange(4))
+
+        game.updatePlayers(players)
+        tick = step + 1
+
+        if roundEndTick is None and game.roundOver(players):
+            roundEndTick = tick + 120
+        elif roundEndTick is not None and tick >= roundEndTick:
+            grid.reset()
+            for player, spawn in zip(players, spawns):
+                player.reset(*spawn)
+            roundEndTick = None
+
+        sent = host.bytesSent
+        host.sendTick(tick)
+        bytesPerTick.append(host.bytesSent - sent)
+        history[tick] = (grid.colors.tobytes(), [(p.x, p.y, p.nextx, p.nexty, p.crashed) for p in players])
+
+        link.pump(now)
+
+        if client.update(now):
+            colors, positions = history[client.tick]
+            checked += 1
+            if (clientGrid.colors.tobytes() != colors
+                    or [(p.x, p.y, p.nextx, p.nexty, p.crashed) for p in clientPlayers] != positions):
+                mismatches += 1
+
+        if rng.random() < 0.1:
+            d = rng.randrange(4)
+            if client.inputMasks.get(0, 0) & 1 << d:
+                client.releaseDirection(0, d)
+            else:
+                client.pressDirection(0, d)
+
+    host.close()
+    client.close()
+    link.close()
+
+    bytesPerTick.sort()
+    return {'ticks': ticks,
+            'latency_ms': latency * 1000,
+            'loss': loss,
+            'host_bytes_per_tick': host.bytesSent / ticks,
+            'host_bytes_per_tick_p50': bytesPerTick[len(bytesPerTick) // 2],
+            'host_bytes_per_tick_max': bytesPerTick[-1],
+            'host_kbit_per_s': host.bytesSent * 8 / (ticks * dt) / 1000,
+            'client_bytes_per_tick': client.bytesSent / ticks,
+            'keyframes': host.keyframesSent,
+            'packets_dropped': link.dropped,
+            'deltas_applied': client.deltasApplied,
+            'keyframes_applied': client.keyframesApplied,
+            'gaps': client.gaps,
+            'states_checked': checked,
+            'mismatches': mismatches,
+            'client_lag_ticks': ticks - (client.tick or 0),
+            }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='netplay loopback test: host and client over a lossy link')
+    parser.add_argument('--ticks', type=int, default=3600)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds, one way')
+    parser.add_argument('--jitter', type=float, default=0.01, help='seconds')
+    parser.add_argument('--loss', type=float, default=0.05, help='share of packets dropped, each way')
+    parser.add_argument('--size', default='11x40', help='grid size as WIDTHxHEIGHT')
+    parser.add_argument('--port', type=int, default=NET_PORT + 100)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split('x'))
+    stats = runLoopback(args.ticks, args.latency, args.jitter, args.loss, width, height, args.port, args.seed)
+
+    for key, value in stats.items():
+        print('%-24s %s' % (key, round(value, 2) if isinstance(value, float) else value))
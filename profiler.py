@@ -0,0 +1,268 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+import pygame
+
+import ledwall
+
+
+# -- frame profiler
+#
+# the main loop calls mark(stage) after each of its stages, the time since
+# the previous mark is booked to that stage. finished frames go into a
+# rolling history for the overlay and, if a log file is given, into a queue
+# that a background thread writes out as jsonl (or csv, by file extension).
+# while disabled every call returns right away
+#
+# input latency is measured from the poll of the first input event that
+# changed a player's input to the end of the first compose() after a
+# simulation tick picked it up
+
+STAGES = ['events', 'update', 'grid', 'players', 'text', 'printlog', 'compose', 'wait']
+
+STAGE_COLORS = [(255, 255, 255),
+                (0, 255, 0),
+                (0, 128, 255),
+                (255, 0, 255),
+                (255, 255, 0),
+                (255, 128, 0),
+                (255, 0, 0),
+                (128, 128, 128),
+                ]
+
+TARGET_COLOR = (0, 255, 255)    # 60 fps line in the graph
+
+GRAPH_HEIGHT = 64
+GRAPH_MS_PER_PIXEL = 0.5
+TEXT_INTERVAL = 30      # frames between updates of the overlay numbers
+
+
+class FrameProfiler:
+    def __init__(self, history=128, logFilename=None):
+        self.enabled = False
+        self.enableNextFrame = False
+        self.showOverlay = False
+
+        self.stageIndex = {stage: i for i, stage in enumerate(STAGES)}
+        self.frames = deque(maxlen=history)
+        self.current = [0.] * len(STAGES)
+
+        self.frameNumber = 0
+        self.frameStart = 0.
+        self.lastMark = 0.
+
+        self.overlayLines = []
+
+        self.inputTime = None           # poll time of the oldest input not yet simulated
+        self.simulatedInputTime = None  # ... and of the oldest simulated input not yet presented
+        self.latencies = deque(maxlen=history)
+        self.frameLatency = None
+
+        self.logQueue = None
+        self.logThread = None
+        self.droppedLogFrames = 0
+
+        if logFilename:
+            self.startLog(logFilename)
+
+    def toggleOverlay(self):
+        self.showOverlay = not self.showOverlay
+        self._updateEnabled()
+
+    def _updateEnabled(self):
+        # measuring starts with the next frame, a frame entered in the middle
+        # would be timed from a stale mark
+        wanted = self.showOverlay or self.logQueue is not None
+        self.enableNextFrame = wanted and not self.enabled
+        if not wanted:
+            self.enabled = False
+
+    # -- measuring
+
+    def beginFrame(self):
+        if self.enableNextFrame:
+            self.enabled = True
+            self.enableNextFrame = False
+        if self.enabled:
+            self.frameStart = self.lastMark = time.perf_counter()
+
+    def mark(self, stage):
+        if self.enabled:
+            now = time.perf_counter()
+            self.current[self.stageIndex[stage]] += now - self.lastMark
+            self.lastMark = now
+
+    def endFrame(self):
+        if not self.enabled:
+            return
+
+        frame = self.current
+        self.current = [0.] * len(STAGES)
+        self.frames.append(frame)
+        self.frameNumber += 1
+
+        latency = self.frameLatency
+        self.frameLatency = None
+
+        if self.logQueue is not None:
+            try:
+                self.logQueue.put_nowait((self.frameNumber, self.frameStart, self.lastMark - self.frameStart, frame, latency))
+            except queue.Full:
+                self.droppedLogFrames += 1
+
+    # -- input latency
+
+    def markInput(self, pollTime):
+        if self.inputTime is None:
+            self.inputTime = pollTime
+
+    def markSimulated(self):
+        if self.inputTime is not None and self.simulatedInputTime is None:
+            self.simulatedInputTime = self.inputTime
+            self.inputTime = None
+
+    def markPresented(self):
+        if self.simulatedInputTime is not None:
+            self.frameLatency = time.perf_counter() - self.simulatedInputTime
+            self.latencies.append(self.frameLatency)
+            self.simulatedInputTime = None
+
+    def latencyStats(self):
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return None
+        return {'samples': len(latencies),
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+                'max_ms': latencies[-1] * 1000,
+                }
+
+    def averages(self):
+        n = len(self.frames)
+        if not n:
+            return [0.] * len(STAGES)
+        return [sum(frame[i] for frame in self.frames) / n for i in range(len(STAGES))]
+
+    # -- overlay
+
+    def drawOverlay(self):
+        if not self.showOverlay or not self.frames:
+            return
+
+        output = ledwall.output
+
+        if self.frameNumber % TEXT_INTERVAL == 0 or not self.overlayLines:
+            averages = self.averages()
+            total = sum(averages)
+            self.overlayLines = ['%-8s %5.2f' % (stage, t * 1000) for stage, t in zip(STAGES, averages)]
+            self.overlayLines.append('%-8s %5.2f' % ('frame', total * 1000))
+            self.overlayLines.append('%-8s %5.1f' % ('fps', 1 / total if total else 0))
+
+            stats = self.latencyStats()
+            if stats:
+                self.overlayLines.append('%-8s %5.2f' % ('input', stats['mean_ms']))
+
+        for i, line in enumerate(self.overlayLines):
+            color = STAGE_COLORS[i] if i < len(STAGE_COLORS) else (192, 192, 192)
+            ledwall.drawText(line.upper(), x=0, y=i, color=color)
+
+        # stacked frame time graph, one column per frame, newest on the right
+
+        bottom = ledwall.SCR_H - 1
+        left = ledwall.SCR_W - self.frames.maxlen
+        colors = [ledwall.brightness(c) for c in STAGE_COLORS]
+
+        output.fill((0, 0, 0), (left, bottom - GRAPH_HEIGHT, self.frames.maxlen, GRAPH_HEIGHT + 1))
+
+        for x, frame in enumerate(self.frames, start=left):
+            y = bottom
+            for t, color in zip(frame, colors):
+                h = t * 1000 / GRAPH_MS_PER_PIXEL
+                if h >= 1:
+                    top = max(y - h, bottom - GRAPH_HEIGHT)
+                    pygame.draw.line(output, color, (x, y), (x, top))
+                    y = top
+
+        target = bottom - int(1000 / 60 / GRAPH_MS_PER_PIXEL)
+        pygame.draw.line(output, ledwall.brightness(TARGET_COLOR), (left, target), (ledwall.SCR_W - 1, target))
+
+    # -- telemetry export
+
+    def startLog(self, filename):
+        self.logQueue = queue.Queue(maxsize=1024)
+        self.logThread = threading.Thread(target=self._writeLog, args=(filename, self.logQueue), daemon=True)
+        self.logThread.start()
+        self._updateEnabled()
+
+    def stopLog(self):
+        if self.logQueue is None:
+            return
+
+        self.logQueue.put(None)
+        self.logThread.join()
+
+        self.logQueue = None
+        self.logThread = None
+        self._updateEnabled()
+
+    def _writeLog(self, filename, logQueue):
+        csv = filename.endswith('.csv')
+
+        with open(filename, 'w') as f:
+            if csv:
+                f.write(','.join(['frame', 'time', 'total_ms'] + [stage + '_ms' for stage in STAGES] + ['input_latency_ms']) + '\n')
+
+            while True:
+                entry = logQueue.get()
+                if entry is None:
+                    break
+
+                frameNumber, start, total, frame, latency = entry
+
+                if csv:
+                    f.write('%d,%.6f,%.4f,' % (frameNumber, start, total * 1000))
+                    f.write(','.join('%.4f' % (t * 1000) for t in frame))
+                    f.write(',%.4f\n' % (latency * 1000) if latency is not None else ',\n')
+                else:
+                    record = {'frame': frameNumber, 'time': start, 'total_ms': total * 1000}
+                    for stage, t in zip(STAGES, frame):
+                        record[stage + '_ms'] = t * 1000
+                    if latency is not None:
+                        record['input_latency_ms'] = latency * 1000
+                    f.write(json.dumps(record) + '\n')
+
+                if logQueue.empty():
+                    f.flush()
+
+
+# -- startup timing
+#
+# the startup sequence marks the end of each of its steps, the time since
+# the previous mark is booked to that step. report() lists the steps and
+# checks the total (usually up to the first presented frame) against a budget
+
+class StartupTimer:
+    def __init__(self, start=None):
+        self.start = self.last = time.perf_counter() if start is None else start
+        self.steps = []
+
+    def mark(self, step):
+        now = time.perf_counter()
+        self.steps.append((step, now - self.last))
+        self.last = now
+
+    def total(self):
+        return self.last - self.start
+
+    def report(self, budget=None):
+        lines = ['%-12s %7.1f ms' % (step, t * 1000) for step, t in self.steps]
+
+        total = '%-12s %7.1f ms' % ('startup', self.total() * 1000)
+        if budget is not None:
+            total += ' (budget %.0f ms%s)' % (budget * 1000, ', exceeded' if self.total() > budget else '')
+        lines.append(total)
+
+        return lines
@@ -0,0 +1,73 @@
+import struct
+
+
+# -- input recording
+#
+# a log is a 8 byte header followed by one 5 byte record per press or
+# release: the simulation tick (uint32) and a code byte with the press flag
+# in bit 7, the player in bits 2..6 and the direction in bits 0..1 (same
+# order as Player.pressDirection()). the log is closed by an end record
+# (code 0xff) holding the final tick, followed by the 20 byte state hash
+
+MAGIC = b'HXRP'
+VERSION = 1
+
+HEADER = struct.Struct('<4sBxxx')
+RECORD = struct.Struct('<IB')
+
+END_CODE = 0xff
+PRESSED = 0x80
+MAX_PLAYERS = 32
+
+
+class InputRecorder:
+    def __init__(self, filename):
+        self.file = open(filename, 'wb')
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.events = 0
+
+    def record(self, tick, player, direction, pressed):
+        if player >= MAX_PLAYERS:
+            return
+        code = (PRESSED if pressed else 0) | player << 2 | direction
+        self.file.write(RECORD.pack(tick, code))
+        self.events += 1
+
+    def close(self, tick, stateHash):
+        self.file.write(RECORD.pack(tick, END_CODE))
+        self.file.write(stateHash)
+        self.file.close()
+
+
+class InputLog:
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            data = f.read()
+
+        magic, version = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a hexgrid input log' % filename)
+
+        self.ticks = {}     # tick -> [(player, direction, pressed), ...]
+        self.endTick = None
+        self.stateHash = None
+        self.events = 0
+
+        offset = HEADER.size
+        while offset + RECORD.size <= len(data):
+            tick, code = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+
+            if code == END_CODE:
+                self.endTick = tick
+                self.stateHash = data[offset:offset + 20]
+                break
+
+            self.ticks.setdefault(tick, []).append((code >> 2 & 0x1f, code & 0x03, bool(code & PRESSED)))
+            self.events += 1
+
+        if self.endTick is None:    # recording was interrupted, replay what is there
+            self.endTick = max(self.ticks, default=0) + 1
+
+    def eventsAt(self, tick):
+        return self.ticks.get(tick, ())
@@ -0,0 +1,149 @@
+import numpy as np
+import pygame
+
+import ddp
+import ledwall
+
+
+# -- tiled output for several led walls
+#
+# the grid is drawn into one canvas spanning all walls, every wall is a tile
+# (subsurface) of it. a spatial index maps every segment to the tiles its
+# line touches. per frame only the tiles hit by segment changes, by players
+# (now or in the last frame) or by text are restored from the retained grid
+# surface, redrawn and pushed to their wall, so the cost follows activity
+# rather than wall area
+
+LINE_MARGIN = 1     # pixels a line may reach beyond its end points
+
+
+class TiledView:
+    def __init__(self, view, canvas, panels, hosts=(), port=ddp.DDP_PORT, delta=True):
+        self.view = view
+        self.canvas = canvas
+
+        self.panelsX, self.panelsY = panels
+        self.tileW = canvas.get_width() // self.panelsX
+        self.tileH = canvas.get_height() // self.panelsY
+
+        self.tileRects = [pygame.Rect(tx * self.tileW, ty * self.tileH, self.tileW, self.tileH)
+                          for ty in range(self.panelsY) for tx in range(self.panelsX)]
+        self.tiles = [canvas.subsurface(rect) for rect in self.tileRects]
+        self.allTiles = frozenset(range(len(self.tiles)))
+
+        # one ddp sender per wall, walls without a host are only previewed
+        hosts = list(hosts) + [None] * (len(self.tiles) - len(hosts))
+        self.senders = [ddp.DdpSender(host, port, self.tileW, self.tileH, delta) if host else None
+                        for host in hosts[:len(self.tiles)]]
+
+        self.geometry = None
+        self.segmentTiles = None    # segment index -> tuple of tile indices
+        self.state = None
+
+        self.restoreTiles = set(self.allTiles)  # covered by players or text in the last frame
+        self.dirtyTiles = set()
+
+        self.framesPresented = 0
+        self.tilesPresented = 0
+
+    def buildIndex(self, geometry):
+        c = np.frombuffer(geometry.segmentCoords, dtype=np.float64).reshape(-1, 4)
+
+        left = np.minimum(c[:, 0], c[:, 2]) - LINE_MARGIN
+        right = np.maximum(c[:, 0], c[:, 2]) + LINE_MARGIN
+        top = np.minimum(c[:, 1], c[:, 3]) - LINE_MARGIN
+        bottom = np.maximum(c[:, 1], c[:, 3]) + LINE_MARGIN
+
+        tx0 = np.clip(left // self.tileW, 0, self.panelsX - 1).astype(int).tolist()
+        tx1 = np.clip(right // self.tileW, 0, self.panelsX - 1).astype(int).tolist()
+        ty0 = np.clip(top // self.tileH, 0, self.panelsY - 1).astype(int).tolist()
+        ty1 = np.clip(bottom // self.tileH, 0, self.panelsY - 1).astype(int).tolist()
+
+        self.segmentTiles = [tuple(ty * self.panelsX + tx for ty in range(y0, y1 + 1) for tx in range(x0, x1 + 1))
+                             for x0, x1, y0, y1 in zip(tx0, tx1, ty0, ty1)]
+        self.geometry = geometry
+
+    def rectTiles(self, rect):
+        tx0 = min(max(rect.left // self.tileW, 0), self.panelsX - 1)
+        tx1 = min(max((rect.right - 1) // self.tileW, 0), self.panelsX - 1)
+        ty0 = min(max(rect.top // self.tileH, 0), self.panelsY - 1)
+        ty1 = min(max((rect.bottom - 1) // self.tileH, 0), self.panelsY - 1)
+
+        return [ty * self.panelsX + tx for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
+
+    # -- per frame
+
+    def draw(self, players, alpha=0.):
+        view = self.view
+        geometry = view.getGeometry()
+
+        if geometry is not self.geometry:
+            self.buildIndex(geometry)
+            self.restoreTiles = set(self.allTiles)
+
+        # frame brightness is applied per tile in present(), a new level
+        # needs every tile
+        state = ledwall.frameBrightnessLevel
+        if state != self.state:
+            self.restoreTiles = set(self.allTiles)
+            self.state = state
+
+        dirty = self.restoreTiles
+
+        # text may be drawn onto the first wall after this, which must not
+        # be dimmed a second time
+        if state < 255:
+            dirty.add(0)
+
+        changed = view.updateSurface(self.canvas)
+        if changed is None:
+            dirty = set(self.allTiles)
+        else:
+            for index in changed:
+                dirty.update(self.segmentTiles[index])
+
+        rects = view.playerRects(players, alpha)
+        playerTiles = set()
+        for rect in rects:
+            playerTiles.update(self.rectTiles(rect))
+        dirty |= playerTiles
+
+        for t in dirty:
+            rect = self.tileRects[t]
+            self.canvas.blit(view.surface, rect, rect)
+
+        view.drawPlayers(self.canvas, players, rects=rects)
+
+        self.dirtyTiles = dirty
+        self.restoreTiles = playerTiles
+
+    def present(self):
+        dirty = self.dirtyTiles
+
+        if ledwall.textDrawn:   # text and console are drawn on the first wall
+            dirty.add(0)
+            self.restoreTiles.add(0)
+
+        if not dirty:
+            return
+
+        for t in dirty:
+            tile = self.tiles[t]
+
+            if ledwall.frameBrightnessLevel < 255:
+                tile.blit(ledwall.dimmer, (0, 0))
+
+            if self.senders[t] is not None:
+                self.senders[t].submit(tile)
+
+        if self.canvas is pygame.display.get_surface():
+            pygame.display.update([self.tileRects[t] for t in dirty])
+
+        self.framesPresented += 1
+        self.tilesPresented += len(dirty)
+        self.dirtyTiles = set()
+
+    def close(self):
+        for sender in self.senders:
+            if sender is not None:
+                sender.stop()
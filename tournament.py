@@ -0,0 +1,248 @@
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+import bot
+import game
+import hexgrid
+
+
+# -- headless tournament
+#
+# plays complete matches between strategies with the game's own movement
+# rules (game.Player, hexgrid.HexGrid), without pygame. matches are spread
+# over a process pool and every finished match is appended to a jsonl file
+# right away. the first line of the file holds the tournament settings;
+# with --resume, matches already in the file are skipped, so an interrupted
+# tournament continues where it stopped (or grows, with a larger --matches)
+#
+#   python3 tournament.py --matches 1000 --strategies bot random --out results.jsonl
+#   python3 tournament.py --matches 1000 --strategies bot random --out results.jsonl --resume
+#
+# strategies choose a target direction mask whenever their player sets off
+# on a new segment. seats are rotated from match to match, so no strategy
+# keeps the same spawn point
+
+MAX_TICKS = 100000      # a match still running after this is a draw
+
+_searches = {}          # per worker process, (width, height) -> bot.BotSearch
+
+
+def botStrategy(grid, players, number, rng, settings):
+    snapshot = [(p.x, p.y, p.nextx, p.nexty, p.crashed) for p in players]
+
+    search = _searches.get((grid.width, grid.height))
+    if search is None:
+        search = _searches[(grid.width, grid.height)] = bot.BotSearch(grid.width, grid.height)
+
+    mask, depth = search.decide(grid.nodeOwner.tolist(), snapshot, number, settings['budget'], settings['depth'])
+    return mask
+
+def randomStrategy(grid, players, number, rng, settings):
+    # any step that does not crash right away
+    player = players[number]
+    moves = bot.MOVES[game.turnState(player.x, player.y, player.nextx, player.nexty)]
+    x, y = player.nextx, player.nexty
+
+    open_ = [mask for mask, (dx, dy) in moves if not grid.isBlocked((x, y), (x + dx, y + dy))]
+    return rng.choice(open_ or [mask for mask, step in moves])
+
+def straightStrategy(grid, players, number, rng, settings):
+    # keeps holding right, a baseline for the others
+    return 1
+
+STRATEGIES = {'bot': botStrategy,
+              'random': randomStrategy,
+              'straight': straightStrategy,
+              }
+
+
+def playMatch(match):
+    start = time.perf_counter()
+    settings = match['settings']
+    width, height = settings['width'], settings['height']
+    strategies = match['strategies']
+
+    rng = random.Random(match['seed'])
+    grid = hexgrid.HexGrid(width, height)
+    spawns = game.spawnPoints(width, height)
+    players = [game.Player(x, y, grid=grid, number=i) for i, (x, y) in enumerate(spawns[:len(strategies)])]
+    for player in players:
+        player.speed = settings['speed']
+
+    segments = [None] * len(players)
+    crashTicks = [None] * len(players)
+    decisions = 0
+
+    tick = 0
+    while not game.roundOver(players) and tick < settings['max_ticks']:
+        for i, player in enumerate(players):
+            segment = (player.x, player.y, player.nextx, player.nexty)
+            if player.crashed or segments[i] == segment:
+                continue
+            segments[i] = segment
+
+            mask = STRATEGIES[strategies[i]](grid, players, i, rng, settings)
+            decisions += 1
+
+            for d in range(4):
+                if mask & 1 << d:
+                    player.pressDirection(d)
+                else:
+                    player.releaseDirection(d)
+
+        game.updatePlayers(players)
+        tick += 1
+
+        for i, player in enumerate(players):
+            if player.crashed and crashTicks[i] is None:
+                crashTicks[i] = tick
+
+    alive = [i for i, player in enumerate(players) if not player.crashed]
+    winner = alive[0] if len(alive) == 1 else None
+
+    return {'match': match['match'],
+            'seed': match['seed'],
+            'strategies': strategies,
+            'winner': winner,
+            'winner_strategy': strategies[winner] if winner is not None else None,
+            'ticks': tick,
+            'crash_ticks': crashTicks,
+            'segments': int((grid.segmentOwner != hexgrid.NO_OWNER).sum()),
+            'decisions': decisions,
+            'seconds': round(time.perf_counter() - start, 4),
+            }
+
+
+def matchList(settings):
+    # deterministic from the settings, so a resumed run plays the same matches
+    strategies = settings['strategies']
+    numPlayers = settings['players']
+
+    for m in range(settings['matches']):
+        seats = [strategies[(m + i) % len(strategies)] for i in range(numPlayers)]
+        yield {'match': m, 'seed': settings['seed'] + m, 'strategies': seats, 'settings': settings}
+
+def readResults(filename):
+    # (settings, results) of a tournament file, a line cut off by an
+    # interrupted write is dropped
+    settings = None
+    results = []
+
+    with open(filename) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if 'tournament' in record:
+                settings = record['tournament']
+            else:
+                results.append(record)
+
+    return settings, results
+
+def summarize(results, strategies):
+    stats = {s: {'seats': 0, 'wins': 0} for s in strategies}
+    draws = 0
+
+    for result in results:
+        for s in result['strategies']:
+            stats[s]['seats'] += 1
+        if result['winner_strategy'] is None:
+            draws += 1
+        else:
+            stats[result['winner_strategy']]['wins'] += 1
+
+    for s in stats.values():
+        s['win_rate'] = s['wins'] / s['seats'] if s['seats'] else 0
+
+    return {'matches': len(results), 'draws': draws, 'strategies': stats}
+
+def runTournament(settings, filename, workers=None, resume=False):
+    results = []
+
+    if resume and os.path.exists(filename):
+        previous, results = readResults(filename)
+        if previous is not None and dict(previous, matches=settings['matches']) != settings:
+            raise ValueError('%s was written with different settings: %s' % (filename, previous))
+
+        # rewrite without a cut off last line before appending
+        with open(filename, 'w') as f:
+            f.write(json.dumps({'tournament': settings}) + '\n')
+            for result in results:
+                f.write(json.dumps(result) + '\n')
+    else:
+        with open(filename, 'w') as f:
+            f.write(json.dumps({'tournament': settings}) + '\n')
+
+    done = {result['match'] for result in results}
+    matches = [match for match in matchList(settings) if match['match'] not in done]
+
+    start = time.perf_counter()
+    played = 0
+
+    # spawn keeps workers independent of the parent's state on every platform
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool, open(filename, 'a') as f:
+        for result in pool.imap_unordered(playMatch, matches, chunksize=1):
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+            results.append(result)
+            played += 1
+
+    elapsed = time.perf_counter() - start
+    summary = summarize(results, settings['strategies'])
+    summary['played'] = played
+    summary['skipped'] = len(done)
+    summary['seconds'] = elapsed
+    summary['matches_per_s'] = played / elapsed if elapsed else 0
+
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='headless tournament between bot strategies')
+    parser.add_argument('--matches', type=int, default=100)
+    parser.add_argument('--players', type=int, default=2)
+    parser.add_argument('--strategies', nargs='+', default=['bot', 'random'], choices=sorted(STRATEGIES))
+    parser.add_argument('--size', default='11x40', help='grid size as WIDTHxHEIGHT')
+    parser.add_argument('--speed', type=float, default=1.0 / 32, help='Player.speed, segments per tick')
+    parser.add_argument('--depth', type=int, default=4, help='bot search depth')
+    parser.add_argument('--budget', type=float, help='bot seconds per decision (default: no limit, reproducible)')
+    parser.add_argument('--max-ticks', type=int, default=MAX_TICKS)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--workers', type=int, help='worker processes (default: all cores)')
+    parser.add_argument('--out', default='tournament.jsonl')
+    parser.add_argument('--resume', action='store_true', help='skip the matches already in --out')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.size.split('x'))
+    if args.players > len(game.spawnPoints(width, height)):
+        parser.error('at most %d players' % len(game.spawnPoints(width, height)))
+
+    settings = {'matches': args.matches,
+                'players': args.players,
+                'strategies': args.strategies,
+                'width': width,
+                'height': height,
+                'speed': args.speed,
+                'depth': args.depth,
+                'budget': args.budget,
+                'max_ticks': args.max_ticks,
+                'seed': args.seed,
+                }
+
+    try:
+        summary = runTournament(settings, args.out, args.workers, args.resume)
+    except ValueError as e:
+        parser.error(str(e))
+    except KeyboardInterrupt:
+        sys.exit('interrupted, continue with --resume')
+
+    json.dump(summary, sys.stdout, indent=2)
+    print()